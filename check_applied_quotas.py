@@ -1,7 +1,14 @@
+import argparse
 import csv
-import boto3
-import time
-from botocore.exceptions import BotoCoreError, ClientError
+from collections import defaultdict
+
+from quota_utils import (
+    DEFAULT_CACHE_TTL,
+    AdaptiveRateLimiter,
+    QuotaSnapshotCache,
+    get_cached_service_quotas,
+    make_client,
+)
 
 
 def read_csv_quotas(csv_file):
@@ -15,39 +22,51 @@ def read_csv_quotas(csv_file):
     return quotas
 
 
-def get_current_quota(client, service_code, quota_name):
-    """Retrieve the current applied quota for a given service and quota name."""
-    try:
-        response = client.list_service_quotas(ServiceCode=service_code)
-        for quota in response['Quotas']:
-            if quota['QuotaName'] == quota_name:
-                return quota['Value']
-    except (BotoCoreError, ClientError) as error:
-        print(f"Error getting current quota for {service_code}, {quota_name}: {error}")
-        return None
+def group_quotas_by_service(csv_quotas):
+    """Group the CSV quotas as {service_code: {quota_name: applied value}}."""
+    grouped = defaultdict(dict)
+    for (service_code, quota_name), value in csv_quotas.items():
+        grouped[service_code][quota_name] = value
+    return grouped
 
 
-def compare_quotas(region, csv_file):
+def compare_quotas(region, csv_file, cache=None):
     """Compare quotas from CSV with current quotas from AWS API."""
-    session = boto3.Session(region_name=region)
-    service_quotas_client = session.client("service-quotas")
+    service_quotas_client = make_client("service-quotas", region)
+    limiter = AdaptiveRateLimiter()
 
     csv_quotas = read_csv_quotas(csv_file)
 
-    for (service_code, quota_name), csv_quota_value in csv_quotas.items():
-        current_quota = get_current_quota(service_quotas_client, service_code, quota_name)
-        if current_quota is not None and current_quota != csv_quota_value:
-            print(f"Quota mismatch for {service_code}/{quota_name}: CSV - {csv_quota_value}, API - {current_quota}")
-        time.sleep(0.2)  # Delay to account for API throttling (5 requests per second)
+    # Fetch each service's full quota list once and resolve its rows through a name index
+    for service_code, rows in group_quotas_by_service(csv_quotas).items():
+        quotas = get_cached_service_quotas(service_quotas_client, region, service_code, cache, limiter)
+        if quotas is None:
+            continue
+        current_quotas = {quota['QuotaName']: quota['Value'] for quota in quotas}
+        for quota_name, csv_quota_value in rows.items():
+            current_quota = current_quotas.get(quota_name)
+            if current_quota is not None and current_quota != csv_quota_value:
+                print(f"Quota mismatch for {service_code}/{quota_name}: CSV - {csv_quota_value}, API - {current_quota}")
 
 
 if __name__ == "__main__":
-    import sys
-    if len(sys.argv) != 3:
-        print("Usage: python check_applied_quotas.py <region> <csv_file>")
-        sys.exit(1)
+    parser = argparse.ArgumentParser(
+        description="Check the quotas in a CSV from get_applied_quotas.py against a region"
+    )
+    parser.add_argument("region", help="Region to check against")
+    parser.add_argument("csv_file", help="CSV file generated from get_applied_quotas.py")
+    parser.add_argument(
+        "--cache-dir",
+        help="Serve quota listings from snapshots in this directory and refresh only expired services",
+    )
+    parser.add_argument(
+        "--cache-ttl",
+        type=int,
+        default=DEFAULT_CACHE_TTL,
+        help=f"Seconds before a cached service snapshot is refreshed (default {DEFAULT_CACHE_TTL})",
+    )
+    args = parser.parse_args()
 
-    REGION = sys.argv[1]
-    CSV_FILE = sys.argv[2]
     print("Checking Applied verses CSV provided quotas. Note this process takes a while due to API throttle rates")
-    compare_quotas(REGION, CSV_FILE)
+    cache = QuotaSnapshotCache(args.cache_dir, args.cache_ttl) if args.cache_dir else None
+    compare_quotas(args.region, args.csv_file, cache)
@@ -2,57 +2,214 @@
 This script gets the EC2 instance families from two regions and compares them. 
 It then prints the instance families that are in the first region, 
 along with the Instance ID to help identify, but not in the second.
+Several target regions can be given, their catalogues are fetched concurrently
+and an availability matrix of the in-use families is printed. Availability can also
+be checked per Availability Zone (including opted-in Local Zones).
+With --counts-only, instance counts are reported instead of instance IDs, and with
+--inventory an organization-wide dataset written by ec2_inventory.py replaces the source region.
 """
-import sys
+import argparse
+import concurrent.futures
 import boto3
 
-def get_in_use_instance_families_and_ids(region):
-    ec2 = boto3.client('ec2', region_name=region)
-    paginator = ec2.get_paginator('describe_instances')
+from ec2_inventory import (
+    collect_running_instances,
+    inventory_label,
+    load_inventory,
+    merge_inventories,
+)
 
-    instance_families_and_ids = {}
+DEFAULT_MAX_WORKERS = 8
+LOCATION_TYPES = ['region', 'availability-zone', 'availability-zone-id']
 
-    for page in paginator.paginate(
-        Filters=[{'Name': 'instance-state-name', 'Values': ['running']}]
-    ):
-        for reservation in page['Reservations']:
-            for instance in reservation['Instances']:
-                family = instance['InstanceType'].split('.')[0]
-                if family in instance_families_and_ids:
-                    instance_families_and_ids[family].append(instance['InstanceId'])
-                else:
-                    instance_families_and_ids[family] = [instance['InstanceId']]
+def compare_instance_families(region1, region2):
+    compare_instance_families_across_regions(region1, [region2])
 
-    return instance_families_and_ids
+def compare_instance_families_across_regions(
+    region1, target_regions, max_workers=DEFAULT_MAX_WORKERS, location_type='region', counts_only=False, inventory=None
+):
+    # Fetch the source inventory and every target catalogue at the same time, each only once.
+    # A ready-made inventory (e.g. organization-wide) is used as-is, region1 then only labels it
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+        if inventory is None:
+            source_future = executor.submit(collect_running_instances, region1, counts_only)
+        target_futures = [
+            executor.submit(get_ec2_families_by_location, region, location_type)
+            for region in target_regions
+        ]
+        if inventory is None:
+            inventory = source_future.result()
+        # With a zonal location type every Availability Zone is compared as its own target
+        families_by_location = {}
+        for future in target_futures:
+            families_by_location.update(future.result())
 
-def compare_instance_families(region1, region2):
-    families_and_ids_region1 = get_in_use_instance_families_and_ids(region1)
-    families_region2 = get_ec2_families(region2)
+    families_region1 = inventory.families()
+    for region2, families_region2 in families_by_location.items():
+        not_in_region2 = {k: v for k, v in families_region1.items() if k not in families_region2}
 
-    not_in_region2 = {k: v for k, v in families_and_ids_region1.items() if k not in families_region2}
+        print(f"EC2 Instance Families in use in {region1} not available in {region2}:")
+        for family, instance_types in not_in_region2.items():
+            print(f"Family: {family}, {inventory.describe(instance_types)}")
 
-    print(f"EC2 Instance Families in use in {region1} not available in {region2}:")
-    for family, ids in not_in_region2.items():
-        print(f"Family: {family}, Instance IDs: {ids}")
+    if len(families_by_location) > 1:
+        print_availability_matrix(region1, inventory, families_by_location)
 
-def get_ec2_families(region):
-    ec2 = boto3.client('ec2', region_name=region)
-    paginator = ec2.get_paginator('describe_instance_types')
+def print_availability_matrix(region1, inventory, families_by_location):
+    regions = list(families_by_location)
+    width = max(len(region) for region in regions + ["yes"])
+    print(f"\nAvailability of EC2 Instance Families in use in {region1}:")
+    print("Family".ljust(12) + "Instances".rjust(10) + "".join(f"  {region.ljust(width)}" for region in regions))
+    families_region1 = inventory.families()
+    for family in sorted(families_region1):
+        instances = sum(inventory.counts[instance_type] for instance_type in families_region1[family])
+        row = family.ljust(12) + str(instances).rjust(10)
+        for region in regions:
+            status = "yes" if family in families_by_location[region] else "no"
+            row += f"  {status.ljust(width)}"
+        print(row)
+
+def compare_instance_types_exact(
+    region1, target_regions, max_workers=DEFAULT_MAX_WORKERS, location_type='availability-zone', counts_only=False,
+    inventory=None,
+):
+    """
+    Check every in-use instance type (not just its family) against each target region's
+    offerings per Availability Zone, reporting the instance IDs whose exact type is not
+    offered anywhere in the target and the types only offered in some of its zones.
+    Only standard Availability Zones are compared; Local and Wavelength Zones offer few
+    types and would list nearly every type as partially available.
+    A given inventory replaces the one collected from region1, which then only labels it.
+    """
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+        if inventory is None:
+            source_future = executor.submit(collect_running_instances, region1, counts_only)
+        target_futures = {
+            region: executor.submit(get_instance_type_offerings, region, location_type)
+            for region in target_regions
+        }
+        zone_futures = {region: executor.submit(get_standard_zones, region) for region in target_regions}
+        if inventory is None:
+            inventory = source_future.result()
+        offerings_by_region = {region: future.result() for region, future in target_futures.items()}
+        standard_zones = {region: future.result() for region, future in zone_futures.items()}
+
+    for region2, offerings in offerings_by_region.items():
+        zones = sorted(zone for zone in offerings if zone in standard_zones[region2])
+        # One set lookup per in-use type and zone, independent of the number of instances
+        zones_by_type = {
+            instance_type: [zone for zone in zones if instance_type in offerings[zone]]
+            for instance_type in inventory.counts
+        }
+
+        print(f"EC2 Instance Types in use in {region1} not available in {region2}:")
+        for instance_type in sorted(inventory.counts):
+            if not zones_by_type[instance_type]:
+                print(f"Instance Type: {instance_type}, {inventory.describe([instance_type])}")
 
-    instance_families = set()
+        print(f"EC2 Instance Types in use in {region1} only available in some zones of {region2}:")
+        for instance_type in sorted(inventory.counts):
+            offered_in = zones_by_type[instance_type]
+            if offered_in and len(offered_in) < len(zones):
+                missing = [zone for zone in zones if zone not in offered_in]
+                print(
+                    f"Instance Type: {instance_type}, Instances: {inventory.counts[instance_type]}, "
+                    f"offered in {', '.join(offered_in)}, not in {', '.join(missing)}"
+                )
 
-    for page in paginator.paginate():
-        for instance_type in page['InstanceTypes']:
-            instance_families.add(instance_type['InstanceType'].split('.')[0])
+def get_instance_type_offerings(region, location_type='region', filters=None):
+    """
+    Return {location: set of instance types offered there} for the region, where a location
+    is the region itself, an Availability/Local Zone name or a zone ID depending on location_type.
+    Uses describe_instance_type_offerings, which only returns type names rather than the full
+    describe_instance_types details.
+    """
+    ec2 = boto3.Session(region_name=region).client('ec2')
+    paginator = ec2.get_paginator('describe_instance_type_offerings')
 
-    return instance_families
+    offerings = {}
+
+    for page in paginator.paginate(LocationType=location_type, Filters=filters or []):
+        for offering in page['InstanceTypeOfferings']:
+            offerings.setdefault(offering['Location'], set()).add(offering['InstanceType'])
+
+    return offerings
+
+def get_standard_zones(region):
+    """
+    Return the names and IDs of the region's standard Availability Zones, leaving out
+    opted-in Local Zones and Wavelength Zones.
+    """
+    ec2 = boto3.Session(region_name=region).client('ec2')
+    zones = set()
+    for zone in ec2.describe_availability_zones()['AvailabilityZones']:
+        if zone.get('ZoneType', 'availability-zone') == 'availability-zone':
+            zones.update((zone['ZoneName'], zone['ZoneId']))
+    return zones
+
+def get_ec2_families_by_location(region, location_type='region'):
+    return {
+        location: {instance_type.split('.')[0] for instance_type in instance_types}
+        for location, instance_types in get_instance_type_offerings(region, location_type).items()
+    }
+
+def get_ec2_families(region):
+    return get_ec2_families_by_location(region).get(region, set())
 
 if __name__ == '__main__':
-    if len(sys.argv) != 3:
-        print("Usage: python check_instance_types.py <region1> <region2>")
-        sys.exit(1)
+    parser = argparse.ArgumentParser(
+        description="Find the EC2 instance families in use in a region that are not available in the target regions"
+    )
+    parser.add_argument(
+        'regions',
+        nargs='+',
+        help="Source region followed by the target region(s), or only the target region(s) with --inventory",
+    )
+    parser.add_argument(
+        '--max-workers',
+        type=int,
+        default=DEFAULT_MAX_WORKERS,
+        help=f"Number of regions fetched concurrently (default {DEFAULT_MAX_WORKERS})",
+    )
+    parser.add_argument(
+        '--location-type',
+        choices=LOCATION_TYPES,
+        default='region',
+        help="Check availability per region (default), or per Availability Zone / Local Zone name or zone ID",
+    )
+    parser.add_argument(
+        '--exact',
+        action='store_true',
+        help="Check exact instance types (e.g. m7i.48xlarge) per Availability Zone instead of families",
+    )
+    parser.add_argument(
+        '--counts-only',
+        action='store_true',
+        help="Report instance counts instead of instance IDs, for very large fleets",
+    )
+    parser.add_argument(
+        '--inventory',
+        help="Use an organization-wide inventory written by ec2_inventory.py instead of a source region",
+    )
+    args = parser.parse_args()
 
-    REGION1 = sys.argv[1]
-    REGION2 = sys.argv[2]
+    if args.inventory:
+        inventories, accounts = load_inventory(args.inventory, args.counts_only)
+        region1, target_regions = inventory_label(inventories, accounts), args.regions
+        inventory = merge_inventories(inventories)
+    else:
+        if len(args.regions) < 2:
+            parser.error("a source region and at least one target region are required")
+        region1, target_regions = args.regions[0], args.regions[1:]
+        inventory = None
 
-    compare_instance_families(REGION1, REGION2)
+    if args.exact:
+        # Exact checks always look at zones, by zone ID if that was asked for
+        zone_location_type = 'availability-zone-id' if args.location_type == 'availability-zone-id' else 'availability-zone'
+        compare_instance_types_exact(
+            region1, target_regions, args.max_workers, zone_location_type, args.counts_only, inventory
+        )
+    else:
+        compare_instance_families_across_regions(
+            region1, target_regions, args.max_workers, args.location_type, args.counts_only, inventory
+        )
@@ -2,112 +2,423 @@
 This script fetches the RDS instance classes and engine version in use in a specified region,
 checks if they are available in a second region,
 and prints out the classes versions and instance IDs that are not available in the second region.
+Each DB instance is checked as the combination of engine, version, class, storage type and
+Multi-AZ, since a class and a version can each be orderable without being orderable together.
+The orderable options of each engine are fetched once per region and shared by every check.
+When an engine has only a few distinct (class, version) pairs in use, just those are requested,
+concurrently, using the API's EngineVersion and DBInstanceClass filters instead of a full scan.
+DB clusters are checked too: Aurora engine modes and Serverless v2 capacity, Multi-AZ DB cluster
+classes, and the DocumentDB and Neptune engines that share the RDS API.
+Several target regions can be given: the source inventory is read once, the targets are
+evaluated concurrently and a region by engine/version/class availability matrix is printed.
 """
-import sys
+import argparse
+import concurrent.futures
+import threading
 import boto3
 
+DEFAULT_MAX_WORKERS = 8
+# A full scan of a large engine such as postgres is around 20 pages of 1000 options, so
+# beyond this many pairs one targeted request per pair stops being cheaper
+DEFAULT_TARGETED_MAX_PAIRS = 20
+PAGE_SIZE = 1000
+# Engines whose storage and availability are set on the cluster rather than its instances
+CLUSTER_STORAGE_ENGINES = {"aurora", "aurora-mysql", "aurora-postgresql", "docdb", "neptune"}
+SERVERLESS_V2_CLASS = "db.serverless"
 
-def get_in_use_rds_classes_and_ids(region):
-    rds = boto3.client("rds", region_name=region)
+
+def get_in_use_rds_instances(region):
+    """
+    Return {(engine, version, class, storage type, Multi-AZ): [instance IDs]} for the DB
+    instances in a region, so each distinct combination is only checked once. This includes
+    DocumentDB and Neptune instances; for them and Aurora, storage type and Multi-AZ belong
+    to the cluster and are None.
+    """
+    # A session per call, as the instance and cluster inventories are fetched in parallel
+    rds = boto3.Session(region_name=region).client("rds")
     paginator = rds.get_paginator("describe_db_instances")
 
-    instance_classes_and_ids = {}
-    instance_engines_and_versions = {}
+    instances_by_combination = {}
 
     for page in paginator.paginate():
         for db_instance in page["DBInstances"]:
-            class_ = db_instance["DBInstanceClass"]
             engine = db_instance["Engine"]
-            engine_version = db_instance["EngineVersion"]
-            if class_ in instance_classes_and_ids:
-                instance_classes_and_ids[class_].append(
-                    db_instance["DBInstanceIdentifier"]
-                )
+            cluster_storage = engine in CLUSTER_STORAGE_ENGINES
+            combination = (
+                engine,
+                db_instance["EngineVersion"],
+                db_instance["DBInstanceClass"],
+                None if cluster_storage else db_instance.get("StorageType"),
+                None if cluster_storage else db_instance.get("MultiAZ", False),
+            )
+            instances_by_combination.setdefault(combination, []).append(
+                db_instance["DBInstanceIdentifier"]
+            )
+
+    return instances_by_combination
+
+
+def get_in_use_db_clusters(region):
+    """
+    Return {(engine, version, engine mode, class): [cluster IDs]} for the DB clusters in a
+    region. The class is db.serverless for Aurora Serverless v2 capacity, the cluster's
+    instance class for Multi-AZ DB clusters, and None otherwise.
+    """
+    rds = boto3.Session(region_name=region).client("rds")
+    paginator = rds.get_paginator("describe_db_clusters")
+
+    clusters_by_combination = {}
+
+    for page in paginator.paginate():
+        for db_cluster in page["DBClusters"]:
+            if db_cluster.get("ServerlessV2ScalingConfiguration"):
+                class_ = SERVERLESS_V2_CLASS
             else:
-                instance_classes_and_ids[class_] = [db_instance["DBInstanceIdentifier"]]
-                instance_engines_and_versions[class_] = (engine, engine_version)
+                class_ = db_cluster.get("DBClusterInstanceClass")
+            combination = (
+                db_cluster["Engine"],
+                db_cluster["EngineVersion"],
+                db_cluster.get("EngineMode", "provisioned"),
+                class_,
+            )
+            clusters_by_combination.setdefault(combination, []).append(
+                db_cluster["DBClusterIdentifier"]
+            )
+
+    return clusters_by_combination
+
+
+def get_in_use_databases(region):
+    """Fetch the DB instance and DB cluster inventories of a region in parallel."""
+    with concurrent.futures.ThreadPoolExecutor(max_workers=2) as executor:
+        instances_future = executor.submit(get_in_use_rds_instances, region)
+        clusters_future = executor.submit(get_in_use_db_clusters, region)
+        return instances_future.result(), clusters_future.result()
 
-    return instance_classes_and_ids, instance_engines_and_versions
 
+class OrderableIndex:
+    """
+    The orderable options of one engine in one region, indexed by (version, class,
+    storage type, Multi-AZ) so a DB instance's exact combination is a single set lookup.
+    Coarser sets are kept to explain why a combination cannot be ordered, along with the
+    engine modes and Multi-AZ DB cluster classes used to check DB clusters.
+    `fetched` is the set of (class, version) pairs requested when only those were, a class
+    of None standing for every class of the version, or None when the index holds every
+    orderable option of the engine.
+    """
 
-def compare_rds_classes(region1, region2):
-    (
-        classes_and_ids_region1,
-        engines_and_versions_region1,
-    ) = get_in_use_rds_classes_and_ids(region1)
+    def __init__(self, options, fetched=None):
+        self.fetched = fetched
+        self.combinations = set()
+        self.classes = set()
+        self.versions = set()
+        self.class_versions = set()
+        self.storage_types = set()
+        self.engine_modes = set()
+        self.cluster_classes = set()
+        for option in options:
+            class_ = option["DBInstanceClass"]
+            version = option["EngineVersion"]
+            storage_type = option.get("StorageType")
+            self.classes.add(class_)
+            self.versions.add(version)
+            self.class_versions.add((class_, version))
+            self.storage_types.add((class_, version, storage_type))
+            self.combinations.add((version, class_, storage_type, False))
+            if option.get("MultiAZCapable"):
+                self.combinations.add((version, class_, storage_type, True))
+            # Instances of cluster storage engines are looked up without storage and Multi-AZ
+            self.combinations.add((version, class_, None, None))
+            for engine_mode in option.get("SupportedEngineModes") or ["provisioned"]:
+                self.engine_modes.add((version, engine_mode))
+            if option.get("SupportsClusters"):
+                self.cluster_classes.add((version, class_))
 
-    not_in_region2 = {}
+    def covers(self, class_versions):
+        """Whether lookups of these (class, version) pairs can be answered, None meaning every pair."""
+        return self.fetched is None or (class_versions is not None and set(class_versions) <= self.fetched)
 
-    for class_, (engine, version) in engines_and_versions_region1.items():
-        classes_region2 = get_rds_classes(region2, engine)
-        engine_versions_region2 = get_rds_engine_versions(region2, engine)
+    def unavailable_reason(self, version, class_, storage_type, multi_az):
+        """Return why the combination cannot be ordered, or None if it can."""
+        if (version, class_, storage_type, multi_az) in self.combinations:
+            return None
+        if self.fetched is not None:
+            # Only the in-use pairs were requested, so classes and versions can't be told apart
+            if (class_, version) not in self.class_versions:
+                return "class and engine version not orderable together"
+        elif not self.combinations:
+            return "engine not available"
+        if class_ not in self.classes and version not in self.versions:
+            return "both class and version not available"
+        if class_ not in self.classes:
+            return "class not available"
+        if version not in self.versions:
+            return "engine version not available"
+        if (class_, version) not in self.class_versions:
+            return "class not available for this engine version"
+        if (class_, version, storage_type) not in self.storage_types:
+            return f"storage type {storage_type} not available for this class and engine version"
+        return "Multi-AZ not available for this class, engine version and storage type"
 
-        class_available = class_ in classes_region2
-        version_available = version in engine_versions_region2
+    def cluster_unavailable_reason(self, version, engine_mode, class_):
+        """Return why a DB cluster of this version, engine mode and class cannot be created, or None if it can."""
+        if self.fetched is None and not self.combinations:
+            return "engine not available"
+        # Versions can only be judged when every class of the version was fetched
+        if (self.fetched is None or (None, version) in self.fetched) and version not in self.versions:
+            return "engine version not available"
+        if class_ == SERVERLESS_V2_CLASS:
+            if (class_, version) not in self.class_versions:
+                return "Aurora Serverless v2 not available for this engine version"
+        elif class_ is not None and (version, class_) not in self.cluster_classes:
+            return "class not available for Multi-AZ DB clusters of this engine version"
+        if (version, engine_mode) not in self.engine_modes:
+            return f"engine mode {engine_mode} not available for this engine version"
+        return None
 
-        if not class_available or not version_available:
-            not_in_region2[class_] = (
-                classes_and_ids_region1[class_],
-                version,
-                class_available,
-                version_available,
+
+class OrderableOptionsCache:
+    """
+    describe_orderable_db_instance_options results per (region, engine), fetched once
+    and kept as an OrderableIndex. When the caller passes the (class, version) pairs it
+    needs and there are at most `targeted_max_pairs` of them, only those pairs are
+    requested, `max_workers` at a time; otherwise the engine's whole catalogue is scanned.
+    Safe to share between threads checking different target regions.
+    """
+
+    def __init__(self, max_workers=DEFAULT_MAX_WORKERS, targeted_max_pairs=DEFAULT_TARGETED_MAX_PAIRS):
+        self.max_workers = max_workers
+        self.targeted_max_pairs = targeted_max_pairs
+        self._indexes = {}
+        self._locks = {}
+        self._lock = threading.Lock()
+
+    def get(self, region, engine, class_versions=None):
+        key = (region, engine)
+        with self._lock:
+            key_lock = self._locks.setdefault(key, threading.Lock())
+        # Per-key lock so each catalogue is fetched once without serialising other regions and engines
+        with key_lock:
+            return self._get(key, class_versions)
+
+    def _get(self, key, class_versions):
+        region, engine = key
+        index = self._indexes.get(key)
+        if index is not None and index.covers(class_versions):
+            return index
+        if class_versions is not None:
+            class_versions = set(class_versions)
+            if index is not None:
+                # Keep the pairs already fetched for an earlier caller
+                class_versions |= index.fetched
+        if class_versions is not None and len(class_versions) <= self.targeted_max_pairs:
+            index = OrderableIndex(
+                get_orderable_options_for(region, engine, class_versions, self.max_workers),
+                fetched=class_versions,
             )
+        else:
+            index = OrderableIndex(get_orderable_options(region, engine))
+        self._indexes[key] = index
+        return index
+
+
+def find_unavailable_combinations(instances_by_combination, region, cache, clusters_by_combination=None):
+    """
+    Evaluate every in-use instance and cluster combination against the orderable index of
+    its engine in one pass. Returns ({instance combination: (instance IDs, reason)},
+    {cluster combination: (cluster IDs, reason)}) for those that cannot be ordered in region.
+    """
+    clusters_by_combination = clusters_by_combination or {}
+    # Every (class, version) pair an engine needs, so instances and clusters share one fetch
+    class_versions_by_engine = {}
+    for engine, version, class_, _, _ in instances_by_combination:
+        class_versions_by_engine.setdefault(engine, set()).add((class_, version))
+    for engine, version, _, class_ in clusters_by_combination:
+        class_versions_by_engine.setdefault(engine, set()).add((class_, version))
+
+    unavailable_instances = {}
+    for combination, ids in instances_by_combination.items():
+        engine, version, class_, storage_type, multi_az = combination
+        index = cache.get(region, engine, class_versions_by_engine[engine])
+        reason = index.unavailable_reason(version, class_, storage_type, multi_az)
+        if reason:
+            unavailable_instances[combination] = (ids, reason)
+
+    unavailable_clusters = {}
+    for combination, ids in clusters_by_combination.items():
+        engine, version, engine_mode, class_ = combination
+        index = cache.get(region, engine, class_versions_by_engine[engine])
+        reason = index.cluster_unavailable_reason(version, engine_mode, class_)
+        if reason:
+            unavailable_clusters[combination] = (ids, reason)
+
+    return unavailable_instances, unavailable_clusters
+
+
+def sort_key(item):
+    return tuple(str(field) for field in item[0])
+
 
+def compare_rds_classes(
+    region1, region2, cache=None, max_workers=DEFAULT_MAX_WORKERS, targeted_max_pairs=DEFAULT_TARGETED_MAX_PAIRS
+):
+    compare_rds_across_regions(region1, [region2], cache, max_workers, targeted_max_pairs)
+
+
+def compare_rds_across_regions(
+    region1, target_regions, cache=None, max_workers=DEFAULT_MAX_WORKERS, targeted_max_pairs=DEFAULT_TARGETED_MAX_PAIRS
+):
+    """
+    Read the DB inventory of region1 once and evaluate it against every target region
+    concurrently, each target's orderable catalogue cached per engine. Prints what cannot be
+    ordered in each target, then an availability matrix when there are several targets.
+    """
+    instances_by_combination, clusters_by_combination = get_in_use_databases(region1)
+    cache = cache or OrderableOptionsCache(max_workers, targeted_max_pairs)
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {
+            region: executor.submit(
+                find_unavailable_combinations, instances_by_combination, region, cache, clusters_by_combination
+            )
+            for region in dict.fromkeys(target_regions)
+        }
+        unavailable_by_region = {region: future.result() for region, future in futures.items()}
+
+    for region2, (instances_not_in_region2, clusters_not_in_region2) in unavailable_by_region.items():
+        print_unavailable(region1, region2, instances_not_in_region2, clusters_not_in_region2)
+
+    if len(unavailable_by_region) > 1:
+        print_availability_matrix(region1, instances_by_combination, clusters_by_combination, unavailable_by_region)
+
+
+def print_unavailable(region1, region2, instances_not_in_region2, clusters_not_in_region2):
     print(
         f"RDS Instance Classes and/or Engine Versions in use in {region1} not available in {region2}:"
     )
-    for class_, (
-        ids,
-        version,
-        class_available,
-        version_available,
-    ) in not_in_region2.items():
-        if not class_available and not version_available:
-            print(
-                f"Class: {class_}, Engine Version: {version}, Instance IDs: {ids} - both class and version not available"
-            )
-        elif not class_available:
-            print(
-                f"Class: {class_}, Engine Version: {version}, Instance IDs: {ids} - class not available"
-            )
-        else:
-            print(
-                f"Class: {class_}, Engine Version: {version}, Instance IDs: {ids} - engine version not available"
-            )
+    for (engine, version, class_, storage_type, multi_az), (ids, reason) in sorted(
+        instances_not_in_region2.items(), key=sort_key
+    ):
+        print(
+            f"Engine: {engine}, Engine Version: {version}, Class: {class_}, Storage Type: {storage_type}, "
+            f"Multi-AZ: {multi_az}, Instance IDs: {ids} - {reason}"
+        )
+
+    print(
+        f"DB Clusters (Aurora, Multi-AZ, DocumentDB, Neptune) in use in {region1} not available in {region2}:"
+    )
+    for (engine, version, engine_mode, class_), (ids, reason) in sorted(
+        clusters_not_in_region2.items(), key=sort_key
+    ):
+        print(
+            f"Engine: {engine}, Engine Version: {version}, Engine Mode: {engine_mode}, Class: {class_}, "
+            f"Cluster IDs: {ids} - {reason}"
+        )
 
 
-def get_rds_classes(region, engine):
-    rds = boto3.client("rds", region_name=region)
-    paginator = rds.get_paginator("describe_orderable_db_instance_options")
+def matrix_row(combination, cluster):
+    """Return the (engine, version, class) matrix row of an instance or cluster combination."""
+    if cluster:
+        engine, version, engine_mode, class_ = combination
+        return engine, version, f"cluster ({class_ or engine_mode})"
+    engine, version, class_, _, _ = combination
+    return engine, version, class_
 
-    instance_classes = set()
 
-    for page in paginator.paginate(Engine=engine):
-        for instance_class in page["OrderableDBInstanceOptions"]:
-            instance_classes.add(instance_class["DBInstanceClass"])
+def print_availability_matrix(region1, instances_by_combination, clusters_by_combination, unavailable_by_region):
+    """
+    Print one row per in-use engine/version/class with its instance or cluster count, and
+    whether it is available in each target region. A row is unavailable in a region when any
+    of its storage type/Multi-AZ combinations cannot be ordered there.
+    """
+    counts = {}
+    for cluster, by_combination in ((False, instances_by_combination), (True, clusters_by_combination)):
+        for combination, ids in by_combination.items():
+            row = matrix_row(combination, cluster)
+            counts[row] = counts.get(row, 0) + len(ids)
 
-    return instance_classes
+    unavailable_rows = {
+        region: {matrix_row(combination, False) for combination in instances_not_in_region}
+        | {matrix_row(combination, True) for combination in clusters_not_in_region}
+        for region, (instances_not_in_region, clusters_not_in_region) in unavailable_by_region.items()
+    }
+
+    regions = list(unavailable_by_region)
+    rows = sorted(counts)
+    headings = ("Engine", "Version", "Class")
+    widths = [max([len(heading)] + [len(row[column]) for row in rows]) for column, heading in enumerate(headings)]
+    width = max(len(region) for region in regions + ["yes"])
+    print(f"\nAvailability of RDS engines, versions and classes in use in {region1}:")
+    print(
+        "  ".join(heading.ljust(widths[column]) for column, heading in enumerate(headings))
+        + "Count".rjust(7)
+        + "".join(f"  {region.ljust(width)}" for region in regions)
+    )
+    for row in rows:
+        line = "  ".join(field.ljust(widths[column]) for column, field in enumerate(row)) + str(counts[row]).rjust(7)
+        for region in regions:
+            status = "no" if row in unavailable_rows[region] else "yes"
+            line += f"  {status.ljust(width)}"
+        print(line)
 
 
-def get_rds_engine_versions(region, engine):
-    rds = boto3.client("rds", region_name=region)
+def get_orderable_options(region, engine, **filters):
+    """
+    Return the orderable options of an engine in a region, optionally narrowed server-side
+    with EngineVersion and/or DBInstanceClass.
+    """
+    # A session per call, as the targeted requests run on several threads
+    rds = boto3.Session(region_name=region).client("rds")
     paginator = rds.get_paginator("describe_orderable_db_instance_options")
 
-    engine_versions = set()
+    options = []
 
-    for page in paginator.paginate(Engine=engine):
-        for option in page["OrderableDBInstanceOptions"]:
-            engine_versions.add(option["EngineVersion"])
+    for page in paginator.paginate(Engine=engine, **filters, PaginationConfig={"PageSize": PAGE_SIZE}):
+        options.extend(page["OrderableDBInstanceOptions"])
 
-    return engine_versions
+    return options
 
 
-if __name__ == "__main__":
-    if len(sys.argv) != 3:
-        print("Usage: python check_rds_types.py <region1> <region2>")
-        sys.exit(1)
+def get_orderable_options_for(region, engine, class_versions, max_workers=DEFAULT_MAX_WORKERS):
+    """
+    Return the orderable options of just the given (class, version) pairs, requested
+    concurrently. A class of None requests every class of the version.
+    """
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = [
+            executor.submit(
+                get_orderable_options,
+                region,
+                engine,
+                EngineVersion=version,
+                **({"DBInstanceClass": class_} if class_ else {}),
+            )
+            for class_, version in class_versions
+        ]
+        return [option for future in futures for option in future.result()]
+
 
-    REGION1 = sys.argv[1]
-    REGION2 = sys.argv[2]
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Find the RDS, Aurora, DocumentDB and Neptune instances and clusters in use in a region "
+        "whose class, engine version, storage, Multi-AZ or engine mode cannot be ordered in the target regions"
+    )
+    parser.add_argument("region1", help="Source region")
+    parser.add_argument("target_regions", nargs="+", help="Target region(s)")
+    parser.add_argument(
+        "--max-workers",
+        type=int,
+        default=DEFAULT_MAX_WORKERS,
+        help="Number of target regions, and of targeted orderable option requests per engine, "
+        f"checked at once (default {DEFAULT_MAX_WORKERS})",
+    )
+    parser.add_argument(
+        "--targeted-max-pairs",
+        type=int,
+        default=DEFAULT_TARGETED_MAX_PAIRS,
+        help="Request only the in-use (class, version) pairs of an engine when there are at most this many, "
+        f"otherwise scan its whole catalogue (default {DEFAULT_TARGETED_MAX_PAIRS}, 0 always scans)",
+    )
+    args = parser.parse_args()
 
-    compare_rds_classes(REGION1, REGION2)
+    compare_rds_across_regions(args.region1, args.target_regions, None, args.max_workers, args.targeted_max_pairs)
@@ -2,34 +2,21 @@
 This script fetches the EC2 instances in use in a specified region, 
 checks if they are available in a second region, and looks up the pricing of each instance type
 (on-demand linux) to provide a total price impact of moving all available instances to the target region.
+With --counts-only, instance counts are reported instead of instance IDs, and with
+--inventory an organization-wide dataset written by ec2_inventory.py replaces the source region,
+each of its source regions priced at its own on-demand rates.
 Requires Vantage API Token
 """
+import argparse
 import sys
-from collections import defaultdict
-import boto3
 import requests
 
+from ec2_inventory import collect_running_instances, inventory_label, load_inventory
+
 TOKEN = "INSERT_TOKEN_HERE"
 HEADERS = {"accept": "application/json", "authorization": f"Bearer {TOKEN}"}
 
 
-def get_in_use_ec2_types_and_ids(region):
-    ec2 = boto3.client("ec2", region_name=region)
-    paginator = ec2.get_paginator("describe_instances")
-
-    instance_types_and_ids = defaultdict(list)
-
-    for page in paginator.paginate():
-        for reservation in page["Reservations"]:
-            for instance in reservation["Instances"]:
-                if instance["State"]["Name"] == "running":
-                    instance_types_and_ids[instance["InstanceType"]].append(
-                        instance["InstanceId"]
-                    )
-
-    return instance_types_and_ids
-
-
 def get_vantage_product_ids():
     url = "https://api.vantage.sh/v1/products?service_id=aws-ec2"
     response = requests.get(url, headers=HEADERS, timeout=10)
@@ -59,31 +46,38 @@ def get_vantage_product_price(product_id, region):
         sys.exit(1)
 
 
-def compare_ec2_pricing(region1, region2):
-    types_and_ids_region1 = get_in_use_ec2_types_and_ids(region1)
+def compare_ec2_pricing(region1, region2, counts_only=False, inventories=None):
+    """
+    Price the instances running in region1 in both region1 and region2. `inventories` maps
+    source regions to ready-made inventories (e.g. organization-wide), each priced in its
+    own source region; region1 then only labels the totals.
+    """
+    if inventories is None:
+        inventories = {region1: collect_running_instances(region1, counts_only)}
     vantage_product_ids = get_vantage_product_ids()
 
     total_cost_region1 = 0
     total_cost_region2 = 0
 
-    for instance_type, instance_ids in types_and_ids_region1.items():
-        product_id = vantage_product_ids.get(instance_type)
-        if product_id:
-            price_region1 = get_vantage_product_price(product_id, region1)
-            price_region2 = get_vantage_product_price(product_id, region2)
+    for source_region, inventory in inventories.items():
+        for instance_type, instance_count in inventory.counts.items():
+            product_id = vantage_product_ids.get(instance_type)
+            if product_id:
+                price_region1 = get_vantage_product_price(product_id, source_region)
+                price_region2 = get_vantage_product_price(product_id, region2)
 
-            if price_region1 is not None and price_region2 is not None:
-                cost_region1 = len(instance_ids) * price_region1
-                cost_region2 = len(instance_ids) * price_region2
+                if price_region1 is not None and price_region2 is not None:
+                    cost_region1 = instance_count * price_region1
+                    cost_region2 = instance_count * price_region2
 
-                total_cost_region1 += cost_region1
-                total_cost_region2 += cost_region2
+                    total_cost_region1 += cost_region1
+                    total_cost_region2 += cost_region2
 
-                print(
-                    f"Instance Type: {instance_type}, Instance IDs: {instance_ids}, Cost in {region1}: ${cost_region1}, Cost in {region2}: ${cost_region2}"
-                )
-            else:
-                print(f"Price not available for instance type: {instance_type}")
+                    print(
+                        f"Instance Type: {instance_type}, {inventory.describe([instance_type])}, Cost in {source_region}: ${cost_region1}, Cost in {region2}: ${cost_region2}"
+                    )
+                else:
+                    print(f"Price not available for instance type: {instance_type} in {source_region}")
 
     print(
         f"\nTotal cost per hour in {region1} (based on on-demand pricing for Linux EC2 instances): ${round(total_cost_region1, 4)}"
@@ -100,11 +94,31 @@ def compare_ec2_pricing(region1, region2):
 
 
 if __name__ == "__main__":
-    if len(sys.argv) != 3:
-        print("Usage: python compare_ec2_pricing.py <region1> <region2>")
-        sys.exit(1)
-
-    REGION1 = sys.argv[1]
-    REGION2 = sys.argv[2]
+    parser = argparse.ArgumentParser(
+        description="Compare the on-demand price of the EC2 instances running in region1 with region2"
+    )
+    parser.add_argument(
+        "regions",
+        nargs="+",
+        help="Region the instances run in followed by the region to price them in, or only the latter with --inventory",
+    )
+    parser.add_argument(
+        "--counts-only",
+        action="store_true",
+        help="Report instance counts instead of instance IDs, for very large fleets",
+    )
+    parser.add_argument(
+        "--inventory",
+        help="Price an organization-wide inventory written by ec2_inventory.py instead of a source region",
+    )
+    args = parser.parse_args()
 
-    compare_ec2_pricing(REGION1, REGION2)
+    if args.inventory:
+        if len(args.regions) != 1:
+            parser.error("only the region to price in is given with --inventory")
+        inventories, accounts = load_inventory(args.inventory, args.counts_only)
+        compare_ec2_pricing(inventory_label(inventories, accounts), args.regions[0], args.counts_only, inventories)
+    else:
+        if len(args.regions) != 2:
+            parser.error("a source region and the region to price in are required")
+        compare_ec2_pricing(args.regions[0], args.regions[1], args.counts_only)
@@ -2,78 +2,234 @@
 compares the Service Quotas between regions, printing out any differences
 """
 
-import sys
-import boto3
-from botocore.exceptions import BotoCoreError, ClientError
-
-
-def get_service_quotas(client, service_code):
-    try:
-        quotas = []
-        paginator = client.get_paginator("list_service_quotas")
-        for page in paginator.paginate(ServiceCode=service_code):
-            quotas.extend(page["Quotas"])
-        return quotas
-    except (BotoCoreError, ClientError) as error:
-        print(f"Error getting quotas for service {service_code}: {error}")
-        return None
-
-
-def compare_service_quotas(region1, region2):
-    session1 = boto3.Session(region_name=region1)
-    session2 = boto3.Session(region_name=region2)
-
-    service_quotas1 = session1.client("service-quotas")
-    service_quotas2 = session2.client("service-quotas")
-
-    paginator1 = service_quotas1.get_paginator("list_services")
-    paginator2 = service_quotas2.get_paginator("list_services")
-
-    services1 = set()
-    for response in paginator1.paginate():
-        for service in response["Services"]:
-            services1.add(service["ServiceCode"])
-
-    services2 = set()
-    for response in paginator2.paginate():
-        for service in response["Services"]:
-            services2.add(service["ServiceCode"])
-
-    common_services = services1.intersection(services2)
-
-    for service in common_services:
-        quotas1 = get_service_quotas(service_quotas1, service)
-        quotas2 = get_service_quotas(service_quotas2, service)
-
-        if quotas1 is None or quotas2 is None:
-            continue
-
-        quotas1_quota_value = {quota["QuotaName"]: quota["Value"] for quota in quotas1}
-        quotas2_quota_value = {quota["QuotaName"]: quota["Value"] for quota in quotas2}
-
-        # Compare quotas in both regions
-        for key in set(quotas1_quota_value.keys()) | set(quotas2_quota_value.keys()):
-            if key in quotas1_quota_value and key in quotas2_quota_value:
-                if quotas1_quota_value[key] != quotas2_quota_value[key]:
-                    print(
-                        f"Different quota for {service} ({key}) in {region1} ({quotas1_quota_value[key]}) and {region2} ({quotas2_quota_value[key]})"
-                    )
-            elif key in quotas1_quota_value:
-                print(
-                    f"Quota {key} for {service} only exists in {region1} ({quotas1_quota_value[key]})"
-                )
-            else:
-                print(
-                    f"Quota {key} for {service} only exists in {region2} ({quotas2_quota_value[key]})"
-                )
+import argparse
+import json
+from itertools import combinations
+
+import quota_async
+from quota_utils import (
+    DEFAULT_CACHE_TTL,
+    DEFAULT_MAX_WORKERS,
+    DEFAULT_RATE,
+    QuotaDiff,
+    QuotaSnapshotCache,
+    diff_quotas,
+    format_quota_diff,
+    get_services,
+    index_quotas,
+    iter_service_quotas,
+    make_client,
+    require_pyarrow,
+    write_columnar,
+)
+
+COLUMNAR_DICTIONARY_COLUMNS = (
+    "region1",
+    "region2",
+    "status",
+    "service_code",
+    "quota_code",
+    "quota_name",
+)
+
+
+def region_pairs(regions, baseline=None):
+    """Return the (region1, region2) pairs to compare: each region against the baseline, or every pair."""
+    if baseline:
+        return [(baseline, region) for region in regions if region != baseline]
+    return list(combinations(regions, 2))
+
+
+def services_to_fetch(offered, pairs):
+    """
+    Return {region: service codes} limited to the services a region shares with at least one
+    region it is paired with, as only those can be compared. `offered` maps each region to
+    the service codes it lists.
+    """
+    services = {region: set() for region in offered}
+    for region1, region2 in pairs:
+        common = offered[region1] & offered[region2]
+        services[region1] |= common
+        services[region2] |= common
+    return services
+
+
+def iter_quota_matrix(
+    regions, max_workers=DEFAULT_MAX_WORKERS, rate=DEFAULT_RATE, cache=None, backend="threads", pairs=None
+):
+    """
+    Fetch each region's quota catalogue exactly once and yield the quota matrix one service
+    at a time as (service_code, {region: {(service_code, quota_code): quota}}), as soon as the
+    service has been fetched from every region.
+    Only services a region shares with a region it is paired with are fetched there (every
+    pair by default). A region is absent for a service when it was not fetched there or the
+    fetch failed.
+    The asyncio backend keeps up to `max_workers` paginations in flight on one thread.
+    """
+    clients = {
+        region: make_client("service-quotas", region)
+        for region in regions
+    }
+    offered = {region: set(get_services(client)) for region, client in clients.items()}
+    services = services_to_fetch(offered, region_pairs(regions) if pairs is None else pairs)
+
+    if backend == "asyncio":
+        fetched = quota_async.iter_service_quotas(services, max_workers, rate, cache)
+    else:
+        fetched = iter_service_quotas(clients, services, max_workers, rate, cache)
+    for service, quotas in fetched:
+        yield service, {
+            region: index_quotas(region_quotas)
+            for region, region_quotas in quotas.items()
+            if region_quotas is not None
+        }
+
+
+def iter_quota_differences(
+    regions,
+    baseline=None,
+    max_workers=DEFAULT_MAX_WORKERS,
+    rate=DEFAULT_RATE,
+    cache=None,
+    backend="threads",
+):
+    """Yield (region1, region2, QuotaDiff) for every difference, streamed service by service."""
+    pairs = region_pairs(regions, baseline)
+    for _, by_region in iter_quota_matrix(regions, max_workers, rate, cache, backend, pairs):
+        for region1, region2 in pairs:
+            # Only compare services offered (and fetched) in both regions
+            if region1 in by_region and region2 in by_region:
+                for diff in diff_quotas(by_region[region1], by_region[region2]):
+                    yield region1, region2, diff
+
+
+def diff_record(region1, region2, diff):
+    """Return a difference as a flat dict, as written to NDJSON and columnar output."""
+    return dict(region1=region1, region2=region2, **diff._asdict())
+
+
+def compare_region_quotas(
+    regions,
+    baseline=None,
+    max_workers=DEFAULT_MAX_WORKERS,
+    rate=DEFAULT_RATE,
+    cache=None,
+    columnar_file=None,
+    output_format="text",
+    backend="threads",
+):
+    """
+    Compare quotas across any number of regions from a single fetch per region.
+    With a baseline every other region is compared against it, otherwise every pair is compared.
+    The ndjson format prints one JSON record per difference as soon as its service has been
+    fetched. The text format does the same for a single pair, and with several pairs groups
+    the differences by pair once every service is done.
+    With a columnar_file the differences are also written there by write_columnar().
+    """
+    pairs = region_pairs(regions, baseline)
+    text_diffs = {pair: [] for pair in pairs}
+    columns = {name: [] for name in ("region1", "region2") + QuotaDiff._fields}
+
+    for region1, region2, diff in iter_quota_differences(
+        regions, baseline, max_workers, rate, cache, backend
+    ):
+        if output_format == "ndjson":
+            print(json.dumps(diff_record(region1, region2, diff)), flush=True)
+        elif len(pairs) == 1:
+            print(format_quota_diff(diff, region1, region2))
+        else:
+            text_diffs[(region1, region2)].append(diff)
+        if columnar_file:
+            for name, value in diff_record(region1, region2, diff).items():
+                columns[name].append(value)
+
+    if output_format == "text" and len(pairs) > 1:
+        for region1, region2 in pairs:
+            print(f"\n{region1} vs {region2}:")
+            for diff in sorted(text_diffs[(region1, region2)], key=lambda diff: diff.service_code):
+                print(format_quota_diff(diff, region1, region2))
+
+    if columnar_file:
+        write_columnar(columns, columnar_file, COLUMNAR_DICTIONARY_COLUMNS)
+
+
+def compare_service_quotas(
+    region1, region2, max_workers=DEFAULT_MAX_WORKERS, rate=DEFAULT_RATE, cache=None
+):
+    compare_region_quotas([region1, region2], None, max_workers, rate, cache)
 
 
 if __name__ == "__main__":
-    if len(sys.argv) != 3:
-        print("Usage: python compareQuotas.py <region1> <region2>")
-        sys.exit(1)
-
-    REGION1 = sys.argv[1]
-    REGION2 = sys.argv[2]
-
-    compare_service_quotas(REGION1, REGION2)
+    parser = argparse.ArgumentParser(
+        description="Compare the Service Quotas between two or more regions"
+    )
+    parser.add_argument("regions", nargs="+", help="Regions to compare (at least two)")
+    parser.add_argument(
+        "--baseline",
+        help="Only report where each region differs from this baseline region",
+    )
+    parser.add_argument(
+        "--max-workers",
+        type=int,
+        help=f"Number of services fetched concurrently (default {DEFAULT_MAX_WORKERS} threads, "
+        f"or {quota_async.DEFAULT_CONCURRENCY} with --backend asyncio)",
+    )
+    parser.add_argument(
+        "--backend",
+        choices=["threads", "asyncio"],
+        default="threads",
+        help="Fetch on a thread pool, or on one asyncio event loop (requires aiobotocore)",
+    )
+    parser.add_argument(
+        "--rate",
+        type=float,
+        default=DEFAULT_RATE,
+        help=f"Starting Service Quotas requests per second per region (default {DEFAULT_RATE})",
+    )
+    parser.add_argument(
+        "--cache-dir",
+        help="Serve quota listings from snapshots in this directory and refresh only expired services",
+    )
+    parser.add_argument(
+        "--cache-ttl",
+        type=int,
+        default=DEFAULT_CACHE_TTL,
+        help=f"Seconds before a cached service snapshot is refreshed (default {DEFAULT_CACHE_TTL})",
+    )
+    parser.add_argument(
+        "--parquet",
+        metavar="FILE",
+        help="Also write the differences to this Parquet file (Arrow IPC if it ends in .arrow), requires pyarrow",
+    )
+    parser.add_argument(
+        "--format",
+        choices=["text", "ndjson"],
+        default="text",
+        help="text groups differences by region pair, ndjson streams one JSON record per difference",
+    )
+    args = parser.parse_args()
+
+    regions = list(dict.fromkeys(args.regions))
+    if args.baseline and args.baseline not in regions:
+        regions.insert(0, args.baseline)
+    if len(regions) < 2:
+        parser.error("at least two distinct regions are required")
+
+    if args.backend == "asyncio":
+        quota_async.require_aiobotocore()
+    if args.parquet:
+        require_pyarrow()
+    max_workers = args.max_workers or (
+        quota_async.DEFAULT_CONCURRENCY if args.backend == "asyncio" else DEFAULT_MAX_WORKERS
+    )
+    cache = QuotaSnapshotCache(args.cache_dir, args.cache_ttl) if args.cache_dir else None
+    compare_region_quotas(
+        regions,
+        args.baseline,
+        max_workers,
+        args.rate,
+        cache,
+        args.parquet,
+        args.format,
+        args.backend,
+    )
@@ -1,56 +1,117 @@
 """
-
+compares a filtered family of Service Quotas between two regions, by default the
+quotas for Running EC2 Instances/Hosts, printing out any differences
 """
-import sys
+import argparse
+import concurrent.futures
+import re
 from botocore.exceptions import BotoCoreError, ClientError
-import boto3
 
-def get_service_quotas(client, service_code):
+from quota_utils import AdaptiveRateLimiter, diff_quotas, format_quota_diff, make_client, paginate
+
+DEFAULT_SERVICE = "ec2"
+DEFAULT_NAME_PREFIX = "Running"
+
+
+def make_quota_filter(name_prefix=None, code_prefix=None, name_regex=None):
+    """Return a predicate matching quotas on QuotaName prefix, QuotaCode prefix and/or a QuotaName regex."""
+    pattern = re.compile(name_regex) if name_regex else None
+
+    def quota_filter(quota):
+        if name_prefix and not quota["QuotaName"].startswith(name_prefix):
+            return False
+        if code_prefix and not quota["QuotaCode"].startswith(code_prefix):
+            return False
+        if pattern and not pattern.search(quota["QuotaName"]):
+            return False
+        return True
+
+    return quota_filter
+
+
+def get_service_quotas(client, service_code, quota_filter, limiter=None):
+    """Retrieve the quotas of a service that match `quota_filter`, applying it page by page."""
     try:
-        response = client.list_service_quotas(ServiceCode=service_code)
+        return [
+            quota
+            for page in paginate(client, "list_service_quotas", limiter, ServiceCode=service_code)
+            for quota in page["Quotas"]
+            if quota_filter(quota)
+        ]
     except (BotoCoreError, ClientError) as error:
         print(f"Error getting quotas for service {service_code}: {error}")
         return None
 
-    # Filter quotas that start with 'Running'
-    quotas = [
-        quota
-        for quota in response["Quotas"]
-        if quota["QuotaName"].startswith("Running")
-    ]
-
-    return quotas
 
+def compare_service_quotas(
+    region1,
+    region2,
+    service=DEFAULT_SERVICE,
+    name_prefix=None,
+    code_prefix=None,
+    name_regex=None,
+):
+    """
+    Compare the quotas of `service` matching the given filters between two regions.
+    With no filter at all, the quotas whose name starts with "Running" are compared.
+    """
+    if name_prefix is None and not code_prefix and not name_regex:
+        name_prefix = DEFAULT_NAME_PREFIX
+    service_quotas1 = make_client("service-quotas", region1)
+    service_quotas2 = make_client("service-quotas", region2)
 
-def compare_service_quotas(region1, region2):
-    session1 = boto3.Session(region_name=region1)
-    session2 = boto3.Session(region_name=region2)
+    quota_filter = make_quota_filter(name_prefix, code_prefix, name_regex)
 
-    service_quotas1 = session1.client("service-quotas")
-    service_quotas2 = session2.client("service-quotas")
-
-    # Use the service code for EC2
-    service = "ec2"
-
-    quotas1 = get_service_quotas(service_quotas1, service)
-    quotas2 = get_service_quotas(service_quotas2, service)
+    # Page through both regions in parallel
+    with concurrent.futures.ThreadPoolExecutor(max_workers=2) as executor:
+        future1 = executor.submit(
+            get_service_quotas, service_quotas1, service, quota_filter, AdaptiveRateLimiter()
+        )
+        future2 = executor.submit(
+            get_service_quotas, service_quotas2, service, quota_filter, AdaptiveRateLimiter()
+        )
+        quotas1 = future1.result()
+        quotas2 = future2.result()
 
     if quotas1 is None or quotas2 is None:
         return
 
-    for quota1, quota2 in zip(quotas1, quotas2):
-        if quota1["Value"] != quota2["Value"]:
-            print(
-                f"Different quota for {service} ({quota1['QuotaName']}) in {region1} ({quota1['Value']}) and {region2} ({quota2['Value']})"
-            )
+    # Join on QuotaCode rather than list position, the two regions may order quotas differently
+    for diff in diff_quotas(quotas1, quotas2):
+        print(format_quota_diff(diff, region1, region2))
 
 
 if __name__ == "__main__":
-    if len(sys.argv) != 3:
-        print("Usage: python compare_running_ec2_quotas.py <region1> <region2>")
-        sys.exit(1)
-
-    REGION1 = sys.argv[1]
-    REGION2 = sys.argv[2]
+    parser = argparse.ArgumentParser(
+        description="Compare a filtered family of Service Quotas between two regions"
+    )
+    parser.add_argument("region1", help="Source region")
+    parser.add_argument("region2", help="Target region")
+    parser.add_argument(
+        "--service",
+        default=DEFAULT_SERVICE,
+        help=f"Service code to compare (default {DEFAULT_SERVICE})",
+    )
+    parser.add_argument(
+        "--name-prefix",
+        help=f"Only compare quotas whose name starts with this "
+        f"(default '{DEFAULT_NAME_PREFIX}' when no other filter is given, '' for all)",
+    )
+    parser.add_argument(
+        "--code-prefix",
+        help="Only compare quotas whose QuotaCode starts with this",
+    )
+    parser.add_argument(
+        "--name-regex",
+        help="Only compare quotas whose name matches this regular expression",
+    )
+    args = parser.parse_args()
 
-    compare_service_quotas(REGION1, REGION2)
+    compare_service_quotas(
+        args.region1,
+        args.region2,
+        args.service,
+        args.name_prefix,
+        args.code_prefix,
+        args.name_regex,
+    )
@@ -0,0 +1,243 @@
+"""
+Collects the running EC2 instance inventory of a region in a compact form, so that
+fleets of tens of thousands of instances stay cheap to hold and iterate.
+Run as a script it inventories every organization member account across the given
+source regions and writes a single "what would move" JSON dataset, which
+check_instance_types.py and compare_ec2_pricing.py accept with --inventory.
+"""
+import argparse
+import json
+import os
+import sys
+
+import boto3
+
+from org_utils import (
+    DEFAULT_MAX_WORKERS,
+    DEFAULT_ROLE_NAME,
+    AccountSessions,
+    for_each_account_region,
+    list_member_accounts,
+)
+
+# describe_instances returns at most 1000 instances per page
+PAGE_SIZE = 1000
+RUNNING_FILTER = [{'Name': 'instance-state-name', 'Values': ['running']}]
+INVENTORY_FILE = 'ec2_inventory.json'
+
+
+class InstanceIdArray:
+    """
+    Append-only list of instance IDs packed into 10 bytes each rather than a str per ID:
+    one byte for the number of hex digits (8 for older IDs, 17 for current ones) and
+    nine for their value, so IDs round-trip exactly.
+    """
+
+    _WIDTH = 10
+
+    def __init__(self):
+        self._data = bytearray()
+
+    def append(self, instance_id):
+        digits = instance_id[2:]
+        self._data.append(len(digits))
+        self._data += int(digits, 16).to_bytes(self._WIDTH - 1, 'big')
+
+    def extend(self, other):
+        self._data += other._data
+
+    def __len__(self):
+        return len(self._data) // self._WIDTH
+
+    def __iter__(self):
+        data = self._data
+        for offset in range(0, len(data), self._WIDTH):
+            value = int.from_bytes(data[offset + 1:offset + self._WIDTH], 'big')
+            yield f"i-{value:0{data[offset]}x}"
+
+
+class InstanceInventory:
+    """
+    Running instances counted by instance type. Instance type strings are interned and the
+    IDs kept in an InstanceIdArray per type, or not kept at all when counts_only is set.
+    """
+
+    def __init__(self, counts_only=False):
+        self.counts_only = counts_only
+        self.counts = {}
+        self._ids = {}
+
+    def add(self, instance_type, instance_id):
+        instance_type = sys.intern(instance_type)
+        self.counts[instance_type] = self.counts.get(instance_type, 0) + 1
+        if not self.counts_only:
+            if instance_type not in self._ids:
+                self._ids[instance_type] = InstanceIdArray()
+            self._ids[instance_type].append(instance_id)
+
+    def merge(self, other):
+        """Fold another inventory's counts and IDs into this one."""
+        for instance_type, count in other.counts.items():
+            instance_type = sys.intern(instance_type)
+            self.counts[instance_type] = self.counts.get(instance_type, 0) + count
+            if not self.counts_only and instance_type in other._ids:
+                if instance_type not in self._ids:
+                    self._ids[instance_type] = InstanceIdArray()
+                self._ids[instance_type].extend(other._ids[instance_type])
+
+    def instance_ids(self, instance_type):
+        """Return the IDs of the running instances of a type (empty in counts-only mode)."""
+        return list(self._ids.get(instance_type, ()))
+
+    def families(self):
+        """Return {family: [instance types in use]}."""
+        families = {}
+        for instance_type in self.counts:
+            families.setdefault(instance_type.split('.')[0], []).append(instance_type)
+        return families
+
+    def describe(self, instance_types):
+        """Describe the instances of the given types for output: their IDs, or just a count."""
+        if self.counts_only:
+            return f"Instances: {sum(self.counts[instance_type] for instance_type in instance_types)}"
+        return f"Instance IDs: {[i for instance_type in instance_types for i in self.instance_ids(instance_type)]}"
+
+
+def collect_running_instances(region, counts_only=False, session=None):
+    """
+    Collect the running instances of a region into an InstanceInventory. Only running
+    instances are requested, 1000 per page, and only their type and ID are kept.
+    """
+    session = session or boto3.Session()
+    ec2 = session.client('ec2', region_name=region)
+    paginator = ec2.get_paginator('describe_instances')
+
+    inventory = InstanceInventory(counts_only)
+
+    for page in paginator.paginate(Filters=RUNNING_FILTER, PaginationConfig={'PageSize': PAGE_SIZE}):
+        for reservation in page['Reservations']:
+            for instance in reservation['Instances']:
+                inventory.add(instance['InstanceType'], instance['InstanceId'])
+
+    return inventory
+
+
+def collect_org_inventory(
+    regions, accounts=None, role_name=DEFAULT_ROLE_NAME, max_workers=DEFAULT_MAX_WORKERS, counts_only=False
+):
+    """
+    Collect the running instances of every organization member account in each source region
+    in parallel. Each account/region inventory is merged into its region's total as soon as
+    it finishes, so only the totals are held. Returns ({region: InstanceInventory}, accounts
+    inventoried in at least one region). Accounts default to all active members of the caller's organization.
+    """
+    account_sessions = AccountSessions(role_name)
+    if not accounts:
+        accounts = list_member_accounts(account_sessions.base_session)
+    print(f"Inventorying {len(accounts)} accounts in {len(regions)} regions")
+
+    def collect(session, account_id, region):
+        return collect_running_instances(region, counts_only, session)
+
+    inventories = {region: InstanceInventory(counts_only) for region in regions}
+    inventoried = set()
+    for account_id, region, inventory in for_each_account_region(
+        collect, accounts, regions, account_sessions, max_workers
+    ):
+        if inventory is not None:
+            inventories[region].merge(inventory)
+            inventoried.add(account_id)
+
+    return inventories, sorted(inventoried)
+
+
+def merge_inventories(inventories):
+    """Merge {region: InstanceInventory} into a single inventory."""
+    counts_only = any(inventory.counts_only for inventory in inventories.values())
+    merged = InstanceInventory(counts_only)
+    for inventory in inventories.values():
+        merged.merge(inventory)
+    return merged
+
+
+def inventory_label(inventories, accounts):
+    """Describe where an inventory dataset came from, for use in place of a source region."""
+    return f"{', '.join(sorted(inventories))} across {len(accounts)} accounts"
+
+
+def save_inventory(path, inventories, accounts):
+    """Write {region: InstanceInventory} and the accounts it covers as a JSON dataset."""
+    dataset = {
+        'accounts': accounts,
+        'regions': {
+            region: {
+                'counts': inventory.counts,
+                'instance_ids': None if inventory.counts_only else {
+                    instance_type: inventory.instance_ids(instance_type) for instance_type in inventory.counts
+                },
+            }
+            for region, inventory in inventories.items()
+        },
+    }
+    with open(path + '.tmp', 'w', encoding='utf-8') as file:
+        json.dump(dataset, file)
+    os.replace(path + '.tmp', path)
+
+
+def load_inventory(path, counts_only=False):
+    """
+    Read a dataset written by save_inventory(), returning ({region: InstanceInventory}, accounts).
+    With counts_only the instance IDs are not loaded.
+    """
+    with open(path, 'r', encoding='utf-8') as file:
+        dataset = json.load(file)
+
+    inventories = {}
+    for region, data in dataset['regions'].items():
+        instance_ids = None if counts_only else data['instance_ids']
+        inventory = InstanceInventory(counts_only=instance_ids is None)
+        if instance_ids is None:
+            inventory.counts = {sys.intern(instance_type): count for instance_type, count in data['counts'].items()}
+        else:
+            for instance_type, ids in instance_ids.items():
+                for instance_id in ids:
+                    inventory.add(instance_type, instance_id)
+        inventories[region] = inventory
+    return inventories, dataset['accounts']
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description="Inventory the running EC2 instances of every organization member account into one dataset"
+    )
+    parser.add_argument('regions', nargs='+', help="Source region(s) to inventory")
+    parser.add_argument(
+        '--output',
+        default=INVENTORY_FILE,
+        help=f"JSON dataset to write (default {INVENTORY_FILE})",
+    )
+    parser.add_argument('--accounts', nargs='+', help="Only inventory these account IDs instead of listing the organization")
+    parser.add_argument(
+        '--role-name',
+        default=DEFAULT_ROLE_NAME,
+        help=f"Role to assume in each member account (default {DEFAULT_ROLE_NAME})",
+    )
+    parser.add_argument(
+        '--max-workers',
+        type=int,
+        default=DEFAULT_MAX_WORKERS,
+        help=f"Number of account/region inventories collected at once (default {DEFAULT_MAX_WORKERS})",
+    )
+    parser.add_argument(
+        '--counts-only',
+        action='store_true',
+        help="Record instance counts per type without instance IDs",
+    )
+    args = parser.parse_args()
+
+    inventories, accounts = collect_org_inventory(
+        args.regions, args.accounts, args.role_name, args.max_workers, args.counts_only
+    )
+    save_inventory(args.output, inventories, accounts)
+    total = sum(sum(inventory.counts.values()) for inventory in inventories.values())
+    print(f"Wrote {total} running instances from {inventory_label(inventories, accounts)} to {args.output}")
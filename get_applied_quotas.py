@@ -1,76 +1,276 @@
-import sys
+import argparse
 import csv
-import boto3
-import time
+import os
 from botocore.exceptions import BotoCoreError, ClientError
 
+from quota_utils import (
+    DEFAULT_CACHE_TTL,
+    AdaptiveRateLimiter,
+    QuotaSnapshotCache,
+    get_cached_service_quotas,
+    get_services,
+    make_client,
+    paginate,
+    require_pyarrow,
+    write_columnar,
+)
+from org_utils import (
+    DEFAULT_MAX_WORKERS,
+    DEFAULT_ROLE_NAME,
+    AccountSessions,
+    for_each_account_region,
+    list_member_accounts,
+)
 
-def get_services(client):
-    """Retrieve all service codes."""
-    services = []
-    paginator = client.get_paginator('list_services')
-    for page in paginator.paginate():
-        for service_info in page['Services']:
-            services.append(service_info['ServiceCode'])
-    return services
+OUTPUT_FILE = "service_quotas.csv"
+CHECKPOINT_SUFFIX = ".checkpoint"
+FLEET_OUTPUT_DIR = "service_quotas"
+COLUMNAR_DICTIONARY_COLUMNS = ("account_id", "region", "service", "quota_name")
 
 
-def get_service_quotas(client, service_code):
-    """Retrieve quotas for a given service."""
-    quotas = []
+def get_default_quotas(client, service_code, limiter=None):
+    """Retrieve all default quotas for a given service as {QuotaCode: Value}."""
     try:
-        paginator = client.get_paginator('list_service_quotas')
-        for page in paginator.paginate(ServiceCode=service_code):
-            quotas.extend(page['Quotas'])
+        defaults = {}
+        for page in paginate(client, 'list_aws_default_service_quotas', limiter, ServiceCode=service_code):
+            for quota in page['Quotas']:
+                defaults[quota['QuotaCode']] = quota['Value']
+        return defaults
     except (BotoCoreError, ClientError) as error:
-        print(f"Error getting quotas for service {service_code}: {error}")
-    return quotas
+        print(f"Error getting default quotas for {service_code}: {error}")
+        return None
 
 
-def get_default_quota(client, service_code, quota_code):
-    """Retrieve the default quota for a given service and quota."""
-    try:
-        response = client.get_aws_default_service_quota(ServiceCode=service_code, QuotaCode=quota_code)
-        return response['Quota']['Value']
-    except (BotoCoreError, ClientError) as error:
-        print(f"Error getting default quota for {service_code}, {quota_code}: {error}")
+def get_applied_quota_rows(client, region, service_code, cache=None, limiter=None):
+    """Return the CSV rows for a service's quotas that differ from the default, or None if a lookup failed."""
+    quotas = get_cached_service_quotas(client, region, service_code, cache, limiter)
+    if quotas is None:
+        return None
+    if not quotas:
+        return []
+    # One paginated listing of defaults per service, joined to the applied values in memory
+    default_quotas = get_default_quotas(client, service_code, limiter)
+    if default_quotas is None:
         return None
+    rows = []
+    for quota in quotas:
+        default_quota = default_quotas.get(quota['QuotaCode'])
+        if default_quota is not None and quota["Value"] != default_quota:
+            rows.append({
+                "Service": service_code,
+                "Quota Name": quota["QuotaName"],
+                "Applied Quota": quota["Value"],
+                "Default Quota": default_quota
+            })
+    return rows
+
+
+def read_checkpoint(checkpoint_file):
+    """Return the service codes recorded as finished in a checkpoint file."""
+    if not os.path.exists(checkpoint_file):
+        return set()
+    with open(checkpoint_file, "r", encoding="utf-8") as file:
+        return {line.strip() for line in file if line.strip()}
+
+
+def write_columnar_quotas(csv_file, columnar_file, region, account_id=None):
+    """Write the rows of a finished CSV to a Parquet/Arrow file, tagged with region and account."""
+    columns = {name: [] for name in ("account_id", "region", "service", "quota_name", "applied_quota", "default_quota")}
+    with open(csv_file, mode='r', newline='') as file:
+        for row in csv.DictReader(file):
+            columns["account_id"].append(account_id)
+            columns["region"].append(region)
+            columns["service"].append(row["Service"])
+            columns["quota_name"].append(row["Quota Name"])
+            columns["applied_quota"].append(float(row["Applied Quota"]))
+            columns["default_quota"].append(float(row["Default Quota"]))
+    write_columnar(columns, columnar_file, COLUMNAR_DICTIONARY_COLUMNS)
 
 
-def check_quotas(region):
-    """Check quotas for a region, output to CSV where applied quota differs from default."""
-    session = boto3.Session(region_name=region)
-    service_quotas_client = session.client("service-quotas")
+def check_quotas(
+    region,
+    cache=None,
+    output_file=OUTPUT_FILE,
+    resume=False,
+    session=None,
+    verbose=True,
+    columnar_file=None,
+    account_id=None,
+):
+    """
+    Check quotas for a region, output to CSV where applied quota differs from default.
+    Each service's rows are flushed as soon as it finishes and the service is recorded in a
+    checkpoint file next to the CSV. With resume, finished services are skipped and the
+    CSV is appended to. The checkpoint is removed once every service has been written.
+    With a columnar_file, the finished CSV is also written there by write_columnar().
+    """
+    service_quotas_client = make_client("service-quotas", region, session)
+    limiter = AdaptiveRateLimiter()
 
-    services = get_services(service_quotas_client)
-    print("Comparing: ")
+    checkpoint_file = output_file + CHECKPOINT_SUFFIX
+    finished = set()
+    if resume and os.path.exists(output_file):
+        finished = read_checkpoint(checkpoint_file)
+        if finished and verbose:
+            print(f"Resuming, skipping {len(finished)} services already in {output_file}")
 
-    with open("service_quotas.csv", "w", newline="") as csvfile:
+    services = get_services(service_quotas_client, limiter)
+    if verbose:
+        print("Comparing: ")
+
+    mode = "a" if finished else "w"
+    complete = True
+    with open(output_file, mode, newline="") as csvfile, open(checkpoint_file, mode, encoding="utf-8") as checkpoint:
         fieldnames = ["Service", "Quota Name", "Applied Quota", "Default Quota"]
         writer = csv.DictWriter(csvfile, fieldnames=fieldnames)
 
-        writer.writeheader()
+        if not finished:
+            writer.writeheader()
         for service_code in services:
-            print(service_code)
-            quotas = get_service_quotas(service_quotas_client, service_code)
-            for quota in quotas:
-                default_quota = get_default_quota(service_quotas_client, service_code, quota['QuotaCode'])
-                if default_quota is not None and quota["Value"] != default_quota:
-                    writer.writerow({
-                        "Service": service_code,
-                        "Quota Name": quota["QuotaName"],
-                        "Applied Quota": quota["Value"],
-                        "Default Quota": default_quota
-                    })
-                time.sleep(0.2)  # Delay to account for API throttling (5 requests per second)
+            if service_code in finished:
+                continue
+            if verbose:
+                print(service_code)
+            rows = get_applied_quota_rows(service_quotas_client, region, service_code, cache, limiter)
+            if rows is None:
+                # Leave the service out of the checkpoint so a resumed run retries it
+                complete = False
+                continue
+            writer.writerows(rows)
+            csvfile.flush()
+            checkpoint.write(f"{service_code}\n")
+            checkpoint.flush()
+
+    if complete:
+        os.remove(checkpoint_file)
+    if columnar_file:
+        write_columnar_quotas(output_file, columnar_file, region, account_id)
+
+
+def check_fleet_quotas(
+    regions,
+    accounts=None,
+    role_name=DEFAULT_ROLE_NAME,
+    output_dir=FLEET_OUTPUT_DIR,
+    cache_dir=None,
+    cache_ttl=DEFAULT_CACHE_TTL,
+    resume=False,
+    max_workers=DEFAULT_MAX_WORKERS,
+    columnar_file=None,
+):
+    """
+    Run check_quotas for every organization member account and region in parallel,
+    writing <output_dir>/<account_id>/<region>/service_quotas.csv for each, and the
+    columnar_file of that name next to it when given.
+    Accounts default to all active members of the caller's organization.
+    """
+    account_sessions = AccountSessions(role_name)
+    if not accounts:
+        accounts = list_member_accounts(account_sessions.base_session)
+    print(f"Sweeping {len(accounts)} accounts in {len(regions)} regions")
+
+    def sweep(session, account_id, region):
+        partition = os.path.join(output_dir, account_id, region)
+        os.makedirs(partition, exist_ok=True)
+        cache = QuotaSnapshotCache(cache_dir, cache_ttl, account_id=account_id) if cache_dir else None
+        check_quotas(
+            region,
+            cache,
+            os.path.join(partition, OUTPUT_FILE),
+            resume,
+            session,
+            verbose=False,
+            columnar_file=os.path.join(partition, columnar_file) if columnar_file else None,
+            account_id=account_id,
+        )
+        return partition
+
+    for account_id, region, partition in for_each_account_region(
+        sweep, accounts, regions, account_sessions, max_workers
+    ):
+        if partition is not None:
+            print(f"{account_id} {region}: {partition}")
 
 
 if __name__ == "__main__":
-    if len(sys.argv) != 2:
-        print("Usage: python get_applied_quotas.py <region>")
-        sys.exit(1)
+    parser = argparse.ArgumentParser(
+        description="Write the applied quotas that differ from the AWS default to a CSV file"
+    )
+    parser.add_argument("regions", nargs="+", help="Region to pull quotas (several with --fleet)")
+    parser.add_argument(
+        "--output",
+        default=OUTPUT_FILE,
+        help=f"CSV file to write (default {OUTPUT_FILE})",
+    )
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        help="Skip services already written by an interrupted run and append to its CSV",
+    )
+    parser.add_argument(
+        "--cache-dir",
+        help="Serve quota listings from snapshots in this directory and refresh only expired services",
+    )
+    parser.add_argument(
+        "--cache-ttl",
+        type=int,
+        default=DEFAULT_CACHE_TTL,
+        help=f"Seconds before a cached service snapshot is refreshed (default {DEFAULT_CACHE_TTL})",
+    )
+    parser.add_argument(
+        "--fleet",
+        action="store_true",
+        help="Sweep every organization member account, writing one CSV per account and region",
+    )
+    parser.add_argument(
+        "--accounts",
+        nargs="+",
+        help="With --fleet, only sweep these account IDs instead of listing the organization",
+    )
+    parser.add_argument(
+        "--role-name",
+        default=DEFAULT_ROLE_NAME,
+        help=f"With --fleet, role to assume in each member account (default {DEFAULT_ROLE_NAME})",
+    )
+    parser.add_argument(
+        "--output-dir",
+        default=FLEET_OUTPUT_DIR,
+        help=f"With --fleet, directory for the per account/region CSVs (default {FLEET_OUTPUT_DIR})",
+    )
+    parser.add_argument(
+        "--max-workers",
+        type=int,
+        default=DEFAULT_MAX_WORKERS,
+        help=f"With --fleet, number of account/region sweeps run at once (default {DEFAULT_MAX_WORKERS})",
+    )
+    parser.add_argument(
+        "--parquet",
+        metavar="FILE",
+        help="Also write the quotas to this Parquet file (Arrow IPC if it ends in .arrow), "
+        "with --fleet the file name written in every account/region directory, requires pyarrow",
+    )
+    args = parser.parse_args()
+
+    if args.parquet:
+        require_pyarrow()
 
-    REGION = sys.argv[1]
     print("Checking Applied verses Default quotas. Note this process takes a while due to API throttle rates")
-    check_quotas(REGION)
-    print("\nDone! Where Applied quota differs from Default it is listed in the created service_quotas.csv file")
+    if args.fleet:
+        check_fleet_quotas(
+            args.regions,
+            args.accounts,
+            args.role_name,
+            args.output_dir,
+            args.cache_dir,
+            args.cache_ttl,
+            args.resume,
+            args.max_workers,
+            args.parquet,
+        )
+        print(f"\nDone! Where Applied quota differs from Default it is listed in the CSV files under {args.output_dir}")
+    else:
+        if len(args.regions) != 1:
+            parser.error("a single region is required unless --fleet is given")
+        cache = QuotaSnapshotCache(args.cache_dir, args.cache_ttl) if args.cache_dir else None
+        check_quotas(args.regions[0], cache, args.output, args.resume, columnar_file=args.parquet)
+        print(f"\nDone! Where Applied quota differs from Default it is listed in the created {args.output} file")
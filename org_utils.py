@@ -0,0 +1,114 @@
+"""
+Shared helpers for running the scripts across the member accounts of an AWS Organization
+"""
+
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import boto3
+
+DEFAULT_ROLE_NAME = "OrganizationAccountAccessRole"
+DEFAULT_SESSION_NAME = "region-migration-tools"
+# Assumed role credentials have to outlast the whole sweep, they are not refreshed
+DEFAULT_DURATION_SECONDS = 3600
+DEFAULT_MAX_WORKERS = 16
+
+
+def list_member_accounts(session=None):
+    """Retrieve the IDs of all active accounts in the caller's organization."""
+    session = session or boto3.Session()
+    organizations = session.client("organizations")
+    accounts = []
+    paginator = organizations.get_paginator("list_accounts")
+    for page in paginator.paginate():
+        for account in page["Accounts"]:
+            if account["Status"] == "ACTIVE":
+                accounts.append(account["Id"])
+    return accounts
+
+
+class AccountSessions:
+    """
+    Hands out boto3 sessions for member accounts by assuming `role_name` in each.
+    STS credentials are cached so every account is assumed at most once per run, and each
+    call returns a new Session so threads never share one. The caller's own account gets
+    the base session itself, so its credentials keep refreshing and its profile and region
+    settings apply.
+    """
+
+    def __init__(
+        self,
+        role_name=DEFAULT_ROLE_NAME,
+        session=None,
+        session_name=DEFAULT_SESSION_NAME,
+        duration_seconds=DEFAULT_DURATION_SECONDS,
+    ):
+        self.role_name = role_name
+        self.base_session = session or boto3.Session()
+        self.session_name = session_name
+        self.duration_seconds = duration_seconds
+        self._sts = self.base_session.client("sts")
+        self._caller_account = None
+        self._credentials = {}
+        self._locks = {}
+        self._lock = threading.Lock()
+
+    def caller_account(self):
+        """Return the ID of the account the base session belongs to."""
+        with self._lock:
+            if self._caller_account is None:
+                self._caller_account = self._sts.get_caller_identity()["Account"]
+            return self._caller_account
+
+    def _get_credentials(self, account_id):
+        with self._lock:
+            account_lock = self._locks.setdefault(account_id, threading.Lock())
+        # Per-account lock so concurrent callers assume each role once without serialising all accounts
+        with account_lock:
+            if account_id not in self._credentials:
+                response = self._sts.assume_role(
+                    RoleArn=f"arn:aws:iam::{account_id}:role/{self.role_name}",
+                    RoleSessionName=self.session_name,
+                    DurationSeconds=self.duration_seconds,
+                )
+                self._credentials[account_id] = response["Credentials"]
+            return self._credentials[account_id]
+
+    def session(self, account_id):
+        """Return a boto3 Session for `account_id`: the base session for the caller's own account, otherwise a new one."""
+        if account_id == self.caller_account():
+            # Used as-is rather than assumed
+            return self.base_session
+        credentials = self._get_credentials(account_id)
+        return boto3.Session(
+            aws_access_key_id=credentials["AccessKeyId"],
+            aws_secret_access_key=credentials["SecretAccessKey"],
+            aws_session_token=credentials["SessionToken"],
+        )
+
+
+def for_each_account_region(func, accounts, regions, account_sessions, max_workers=DEFAULT_MAX_WORKERS):
+    """
+    Run func(session, account_id, region) for every account and region on a thread pool
+    capped at `max_workers`. Yields (account_id, region, result) as each one finishes;
+    failures are printed and yield a result of None.
+    """
+
+    def run(account_id, region):
+        return func(account_sessions.session(account_id), account_id, region)
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {
+            executor.submit(run, account_id, region): (account_id, region)
+            for account_id in accounts
+            for region in regions
+        }
+        for future in as_completed(futures):
+            account_id, region = futures[future]
+            try:
+                result = future.result()
+            except Exception as error:
+                # One failed partition (denied role, opt-in region, bad data) must not end the sweep
+                print(f"Error processing account {account_id} in {region}: {error}")
+                result = None
+            yield account_id, region, result
@@ -0,0 +1,185 @@
+"""
+Optional asyncio backend for the Service Quotas scripts, built on aiobotocore.
+Keeps hundreds of paginations in flight from a single thread, bounded by a semaphore
+and the same per-region adaptive rate limiter as the threaded engine in quota_utils.
+"""
+
+import asyncio
+import sys
+from contextlib import AsyncExitStack
+
+from botocore.exceptions import BotoCoreError, ClientError
+
+from quota_utils import (
+    CONNECTION_ERRORS,
+    DEFAULT_RATE,
+    MAX_THROTTLE_RETRIES,
+    AdaptiveRateLimiter,
+    backoff,
+    is_throttling_error,
+    is_transient_error,
+)
+
+try:
+    from aiobotocore.config import AioConfig
+    from aiobotocore.session import get_session
+except ImportError:
+    get_session = None
+
+DEFAULT_CONCURRENCY = 100
+
+
+def require_aiobotocore():
+    """Exit with a hint when the optional aiobotocore dependency is missing."""
+    if get_session is None:
+        print("The asyncio backend requires aiobotocore, install it with: pip install aiobotocore")
+        sys.exit(1)
+
+
+def limited_client_config():
+    """aiobotocore counterpart of quota_utils.LIMITED_CLIENT_CONFIG, one attempt per call."""
+    return AioConfig(retries={"mode": "standard", "total_max_attempts": 1})
+
+
+async def acquire(limiter):
+    """Wait without blocking the event loop until `limiter` hands out a token."""
+    while True:
+        wait = limiter.try_acquire()
+        if not wait:
+            return
+        await asyncio.sleep(wait)
+
+
+async def call(client, operation, limiter=None, **kwargs):
+    """Async counterpart of quota_utils.call(), retrying throttled requests through the limiter and server and connection errors with a backoff."""
+    method = getattr(client, operation)
+    for attempt in range(MAX_THROTTLE_RETRIES + 1):
+        if limiter is not None:
+            await acquire(limiter)
+        try:
+            response = await method(**kwargs)
+        except ClientError as error:
+            if attempt == MAX_THROTTLE_RETRIES:
+                raise
+            if is_throttling_error(error):
+                if limiter is not None:
+                    limiter.on_throttle()
+                else:
+                    await asyncio.sleep(backoff(attempt))
+            elif is_transient_error(error):
+                await asyncio.sleep(backoff(attempt))
+            else:
+                raise
+            continue
+        except CONNECTION_ERRORS:
+            if attempt == MAX_THROTTLE_RETRIES:
+                raise
+            await asyncio.sleep(backoff(attempt))
+            continue
+        if limiter is not None:
+            limiter.on_success()
+        return response
+
+
+async def paginate(client, operation, limiter=None, **kwargs):
+    """Yield the pages of a NextToken paginated call."""
+    while True:
+        page = await call(client, operation, limiter, **kwargs)
+        yield page
+        if not page.get("NextToken"):
+            return
+        kwargs["NextToken"] = page["NextToken"]
+
+
+async def get_service_quotas(client, service_code, limiter=None):
+    """Retrieve quotas for a given service, or None if the call fails."""
+    try:
+        quotas = []
+        async for page in paginate(client, "list_service_quotas", limiter, ServiceCode=service_code):
+            quotas.extend(page["Quotas"])
+        return quotas
+    except (BotoCoreError, ClientError) as error:
+        print(f"Error getting quotas for service {service_code}: {error}")
+        return None
+
+
+async def _fetch_service_quotas(services, concurrency, rate, cache, results):
+    """Fetch every requested (region, service), putting each finished service on `results`."""
+    try:
+        remaining = {}
+        for service_codes in services.values():
+            for service_code in service_codes:
+                remaining[service_code] = remaining.get(service_code, 0) + 1
+        pending = {service_code: {} for service_code in remaining}
+        limiters = {region: AdaptiveRateLimiter(rate) for region in services}
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async with AsyncExitStack() as stack:
+            session = get_session()
+            clients = {}
+            for region in services:
+                clients[region] = await stack.enter_async_context(
+                    session.create_client("service-quotas", region_name=region, config=limited_client_config())
+                )
+
+            async def fetch(region, service_code):
+                quotas = cache.load(region, service_code) if cache is not None else None
+                if quotas is None:
+                    async with semaphore:
+                        quotas = await get_service_quotas(clients[region], service_code, limiters[region])
+                    if cache is not None and quotas is not None:
+                        cache.store(region, service_code, quotas)
+                return region, service_code, quotas
+
+            tasks = [
+                asyncio.ensure_future(fetch(region, service_code))
+                for region, service_codes in services.items()
+                for service_code in service_codes
+            ]
+            try:
+                for next_done in asyncio.as_completed(tasks):
+                    region, service_code, quotas = await next_done
+                    pending[service_code][region] = quotas
+                    remaining[service_code] -= 1
+                    if not remaining[service_code]:
+                        await results.put((service_code, pending.pop(service_code)))
+            finally:
+                # When the consumer stops early, finish the in-flight fetches before the clients close
+                for task in tasks:
+                    task.cancel()
+                await asyncio.gather(*tasks, return_exceptions=True)
+    finally:
+        await results.put(None)
+
+
+def iter_service_quotas(services, concurrency=DEFAULT_CONCURRENCY, rate=DEFAULT_RATE, cache=None):
+    """
+    Asyncio counterpart of quota_utils.iter_service_quotas(). `services` maps region to the
+    service codes to fetch there, with at most `concurrency` paginations in flight.
+    Yields (service_code, {region: quotas}) as soon as a service has been fetched from
+    every region that was asked for it.
+    """
+    require_aiobotocore()
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    results = asyncio.Queue()
+    task = loop.create_task(_fetch_service_quotas(services, concurrency, rate, cache, results))
+    try:
+        while True:
+            item = loop.run_until_complete(results.get())
+            if item is None:
+                break
+            yield item
+        # Surface any error raised by the fetch
+        loop.run_until_complete(task)
+    finally:
+        # The consumer may stop early (closed generator, broken pipe, Ctrl-C): cancel the
+        # fetch and let it close its clients before the loop goes away
+        if not task.done():
+            task.cancel()
+            try:
+                loop.run_until_complete(task)
+            except asyncio.CancelledError:
+                pass
+        asyncio.set_event_loop(None)
+        loop.close()
@@ -0,0 +1,232 @@
+"""
+Reports quota headroom: joins the Service Quotas that publish a usage metric with their
+current CloudWatch usage in the source region, and shows the utilization that usage would
+have against the same quotas in a target region
+"""
+
+import argparse
+from datetime import datetime, timedelta, timezone
+
+import quota_async
+from quota_utils import (
+    AdaptiveRateLimiter,
+    get_services,
+    index_quotas,
+    iter_service_quotas,
+    make_client,
+    paginate,
+)
+
+# GetMetricData accepts at most 500 metric queries per request
+MAX_METRIC_QUERIES = 500
+DEFAULT_PERIOD = 3600
+DEFAULT_DAYS = 14
+PERIOD_UNIT_SECONDS = {
+    "MICROSECOND": 1e-6,
+    "MILLISECOND": 1e-3,
+    "SECOND": 1,
+    "MINUTE": 60,
+    "HOUR": 3600,
+    "DAY": 86400,
+    "WEEK": 604800,
+}
+
+
+def quota_period_seconds(quota):
+    """Return the length in seconds of a rate quota's Period, or None for quotas without one."""
+    period = quota.get("Period")
+    if not period or period.get("PeriodUnit") not in PERIOD_UNIT_SECONDS:
+        return None
+    return period.get("PeriodValue", 1) * PERIOD_UNIT_SECONDS[period["PeriodUnit"]]
+
+
+def format_period(quota):
+    period = quota["Period"]
+    return f"{period.get('PeriodValue', 1)} {period['PeriodUnit'].lower()}"
+
+
+def usage_statistic(usage_metric):
+    return usage_metric.get("MetricStatisticRecommendation") or "Maximum"
+
+
+def is_comparable(quota):
+    """Whether a quota's usage can be compared with its value: not a rate quota, or one measured with Sum."""
+    return not quota_period_seconds(quota) or usage_statistic(quota["UsageMetric"]) == "Sum"
+
+
+def usage_metric_query(query_id, usage_metric, period):
+    """Build the GetMetricData query for a quota's UsageMetric."""
+    return {
+        "Id": query_id,
+        "MetricStat": {
+            "Metric": {
+                "Namespace": usage_metric["MetricNamespace"],
+                "MetricName": usage_metric["MetricName"],
+                "Dimensions": [
+                    {"Name": name, "Value": value}
+                    for name, value in usage_metric.get("MetricDimensions", {}).items()
+                ],
+            },
+            "Period": period,
+            "Stat": usage_statistic(usage_metric),
+        },
+        "ReturnData": True,
+    }
+
+
+def get_peak_usage(cloudwatch, quotas, days=DEFAULT_DAYS, period=DEFAULT_PERIOD, limiter=None):
+    """
+    Return {(ServiceCode, QuotaCode): peak usage over the last `days`} for the quotas that
+    publish a UsageMetric, fetching up to 500 metrics per GetMetricData call.
+    Rate quotas (those with a Period, such as API CallCount metrics) measured with the Sum
+    statistic are normalised from `period` seconds to the quota's own period, so their peak
+    is the average rate during the busiest metric period. Rate quotas with any other
+    statistic cannot be put on the quota's scale and are left out.
+    """
+    queries = {}
+    for quota in quotas:
+        usage_metric = quota.get("UsageMetric") or {}
+        if usage_metric.get("MetricName") and is_comparable(quota):
+            queries[f"q{len(queries)}"] = quota
+
+    end_time = datetime.now(timezone.utc)
+    start_time = end_time - timedelta(days=days)
+    ids = list(queries)
+    peaks = {}
+    for start in range(0, len(ids), MAX_METRIC_QUERIES):
+        batch = [
+            usage_metric_query(query_id, queries[query_id]["UsageMetric"], period)
+            for query_id in ids[start:start + MAX_METRIC_QUERIES]
+        ]
+        for page in paginate(
+            cloudwatch,
+            "get_metric_data",
+            limiter,
+            MetricDataQueries=batch,
+            StartTime=start_time,
+            EndTime=end_time,
+        ):
+            for result in page["MetricDataResults"]:
+                if not result["Values"]:
+                    continue
+                quota = queries[result["Id"]]
+                key = (quota["ServiceCode"], quota["QuotaCode"])
+                usage = max(result["Values"])
+                quota_period = quota_period_seconds(quota)
+                if quota_period:
+                    usage = usage * quota_period / period
+                peaks[key] = max(peaks.get(key, 0), usage)
+    return peaks
+
+
+def utilization(usage, quota_value):
+    return f"{usage / quota_value:.0%}" if quota_value else "n/a"
+
+
+def report_headroom(
+    source_region, target_region=None, services=None, days=DEFAULT_DAYS, period=DEFAULT_PERIOD, backend="threads"
+):
+    """
+    Print the peak usage of every quota with a UsageMetric in the source region, with its
+    utilization against the source quota and, when given, the target region's quota.
+    Quotas the usage would exceed in the target region are flagged. With the asyncio
+    backend the quotas of both regions are fetched on one event loop.
+    """
+    regions = [source_region] + ([target_region] if target_region else [])
+    clients = {
+        region: make_client("service-quotas", region)
+        for region in regions
+    }
+    if not services:
+        services = get_services(clients[source_region])
+    requested = {source_region: services}
+    if target_region:
+        target_services = set(get_services(clients[target_region]))
+        requested[target_region] = [service for service in services if service in target_services]
+
+    source_quotas = []
+    target_quotas = {}
+    if backend == "asyncio":
+        fetched = quota_async.iter_service_quotas(requested)
+    else:
+        fetched = iter_service_quotas(clients, requested)
+    for _, quotas in fetched:
+        source_quotas.extend(quotas.get(source_region) or [])
+        target_quotas.update(index_quotas(quotas.get(target_region) or []))
+
+    cloudwatch = make_client("cloudwatch", source_region)
+    peaks = get_peak_usage(cloudwatch, source_quotas, days, period, AdaptiveRateLimiter())
+    skipped = sum(
+        1 for quota in source_quotas if (quota.get("UsageMetric") or {}).get("MetricName") and not is_comparable(quota)
+    )
+
+    rows = []
+    for key, quota in index_quotas(source_quotas).items():
+        if key not in peaks:
+            continue
+        target_quota = target_quotas.get(key)
+        target_value = target_quota["Value"] if target_quota else None
+        rows.append((quota, peaks[key], target_value))
+
+    def tightest_first(row):
+        quota, usage, target_value = row
+        limit = target_value if target_region else quota["Value"]
+        return -(usage / limit) if limit else 0
+
+    rows.sort(key=tightest_first)
+
+    print(f"Peak usage over the last {days} days in {source_region}:")
+    if any(quota_period_seconds(quota) for quota, _, _ in rows):
+        print(f"(rate quotas show their average rate over the busiest {period} seconds, short bursts can be higher)")
+    for quota, usage, target_value in rows:
+        per_period = f" per {format_period(quota)}" if quota_period_seconds(quota) else ""
+        line = (
+            f"{quota['ServiceCode']} ({quota['QuotaName']}): usage {usage:g}{per_period}, "
+            f"{source_region} quota {quota['Value']:g} ({utilization(usage, quota['Value'])})"
+        )
+        if target_region:
+            if target_value is None:
+                line += f", not available in {target_region}"
+            else:
+                line += f", {target_region} quota {target_value:g} ({utilization(usage, target_value)})"
+                if usage > target_value:
+                    line += f" - would exceed the {target_region} quota"
+        print(line)
+    if skipped:
+        print(
+            f"Skipped {skipped} rate quotas whose usage metric does not use the Sum statistic, "
+            "so cannot be put on the quota's per-period scale"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Report quota utilization from CloudWatch usage metrics, optionally against a target region"
+    )
+    parser.add_argument("source_region", help="Region whose usage is measured")
+    parser.add_argument("target_region", nargs="?", help="Region whose quotas the usage is checked against")
+    parser.add_argument("--services", nargs="+", help="Service codes to check (default all)")
+    parser.add_argument(
+        "--days",
+        type=int,
+        default=DEFAULT_DAYS,
+        help=f"Days of usage history to take the peak from (default {DEFAULT_DAYS})",
+    )
+    parser.add_argument(
+        "--period",
+        type=int,
+        default=DEFAULT_PERIOD,
+        help=f"Metric period in seconds (default {DEFAULT_PERIOD})",
+    )
+    parser.add_argument(
+        "--backend",
+        choices=["threads", "asyncio"],
+        default="threads",
+        help="Fetch quotas on a thread pool, or on one asyncio event loop (requires aiobotocore)",
+    )
+    args = parser.parse_args()
+
+    if args.backend == "asyncio":
+        quota_async.require_aiobotocore()
+
+    report_headroom(args.source_region, args.target_region, args.services, args.days, args.period, args.backend)
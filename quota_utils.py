@@ -0,0 +1,406 @@
+"""
+Shared helpers for the Service Quotas scripts
+"""
+
+import gzip
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import boto3
+from botocore.config import Config
+from botocore.exceptions import (
+    BotoCoreError,
+    ClientError,
+    ConnectionClosedError,
+    ConnectTimeoutError,
+    EndpointConnectionError,
+    ReadTimeoutError,
+)
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+
+# Service Quotas throttles per account and region; 5 requests per second per region
+# keeps the List APIs under their limit
+DEFAULT_RATE = 5
+DEFAULT_MAX_RATE = 20
+DEFAULT_MIN_RATE = 0.5
+DEFAULT_MAX_WORKERS = 8
+DEFAULT_CACHE_TTL = 24 * 60 * 60
+
+THROTTLING_ERROR_CODES = {
+    "Throttling",
+    "ThrottlingException",
+    "TooManyRequestsException",
+    "RequestLimitExceeded",
+}
+# Network failures botocore would retry itself; with its retries off call() retries them
+CONNECTION_ERRORS = (
+    EndpointConnectionError,
+    ConnectTimeoutError,
+    ReadTimeoutError,
+    ConnectionClosedError,
+)
+MAX_THROTTLE_RETRIES = 8
+# Clients driven by a rate limiter make one attempt per call, so throttling errors reach
+# call() and the limiter instead of being retried silently inside botocore
+LIMITED_CLIENT_CONFIG = Config(retries={"mode": "standard", "total_max_attempts": 1})
+
+CHANGED = "changed"
+ONLY_IN_1 = "only_in_1"
+ONLY_IN_2 = "only_in_2"
+
+# One difference between two quota sets; value1/value2 is None on the side the quota is missing from
+QuotaDiff = namedtuple(
+    "QuotaDiff", ["status", "service_code", "quota_code", "quota_name", "value1", "value2"]
+)
+
+
+class TokenBucket:
+    """Thread-safe token bucket allowing `rate` requests per second with bursts up to `capacity`."""
+
+    def __init__(self, rate=DEFAULT_RATE, capacity=None):
+        self.rate = float(rate)
+        self.capacity = float(capacity or rate)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def try_acquire(self):
+        """Consume a token if one is available and return 0, otherwise return the seconds to wait."""
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(
+                self.capacity, self._tokens + (now - self._updated) * self.rate
+            )
+            self._updated = now
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return 0
+            return (1 - self._tokens) / self.rate
+
+    def acquire(self):
+        """Block until a token is available, then consume it."""
+        while True:
+            wait = self.try_acquire()
+            if not wait:
+                return
+            time.sleep(wait)
+
+    def on_success(self):
+        """Record a request that was accepted."""
+
+    def on_throttle(self):
+        """Record a request that was throttled, pausing every caller until a token refills."""
+        with self._lock:
+            self._tokens = min(self._tokens, 0.0)
+
+
+class AdaptiveRateLimiter(TokenBucket):
+    """
+    Token bucket whose rate adapts with AIMD: every accepted request raises the rate by
+    `increase` up to `max_rate`, every throttled one multiplies it by `decrease` down to
+    `min_rate`. Share one instance between all threads calling the same account and region.
+    """
+
+    def __init__(
+        self,
+        rate=DEFAULT_RATE,
+        min_rate=DEFAULT_MIN_RATE,
+        max_rate=DEFAULT_MAX_RATE,
+        increase=0.1,
+        decrease=0.5,
+    ):
+        super().__init__(rate)
+        self.min_rate = float(min_rate)
+        self.max_rate = float(max(max_rate, rate))
+        self.increase = increase
+        self.decrease = decrease
+
+    def on_success(self):
+        with self._lock:
+            self.rate = min(self.max_rate, self.rate + self.increase)
+
+    def on_throttle(self):
+        with self._lock:
+            self.rate = max(self.min_rate, self.rate * self.decrease)
+            self._tokens = min(self._tokens, 0.0)
+
+
+class QuotaSnapshotCache:
+    """
+    On-disk store of quota listings, one gzipped JSON file per account, region and service
+    recording when it was fetched. Snapshots older than `ttl` seconds are treated as expired.
+    Quotas are account specific, so snapshots are kept under the ID of the account they were
+    fetched from: `account_id` when given, otherwise the caller of `session` (looked up once).
+    """
+
+    def __init__(self, cache_dir, ttl=DEFAULT_CACHE_TTL, session=None, account_id=None):
+        self.cache_dir = cache_dir
+        self.ttl = ttl
+        if account_id is None:
+            session = session or boto3.Session()
+            account_id = session.client("sts").get_caller_identity()["Account"]
+        self.account_id = account_id
+
+    def _path(self, region, service_code):
+        return os.path.join(self.cache_dir, self.account_id, region, f"{service_code}.json.gz")
+
+    def load(self, region, service_code):
+        """Return the cached quotas for a service, or None if missing or expired."""
+        try:
+            with gzip.open(self._path(region, service_code), "rt", encoding="utf-8") as file:
+                snapshot = json.load(file)
+        except (OSError, ValueError):
+            return None
+        if time.time() - snapshot["fetched_at"] > self.ttl:
+            return None
+        return snapshot["quotas"]
+
+    def store(self, region, service_code, quotas):
+        """Write a snapshot of a service's quotas, replacing any previous one atomically."""
+        directory = os.path.dirname(self._path(region, service_code))
+        os.makedirs(directory, exist_ok=True)
+        snapshot = {"fetched_at": time.time(), "quotas": quotas}
+        with tempfile.NamedTemporaryFile(dir=directory, suffix=".tmp", delete=False) as tmp:
+            with gzip.open(tmp, "wt", encoding="utf-8") as file:
+                json.dump(snapshot, file, default=str)
+        os.replace(tmp.name, self._path(region, service_code))
+
+
+def make_client(service_name="service-quotas", region_name=None, session=None):
+    """
+    Create a client for use with call()/paginate(). botocore's retries are turned off so
+    that every throttling error is seen by the rate limiter; call() does the retrying.
+    """
+    session = session or boto3.Session(region_name=region_name)
+    return session.client(service_name, region_name=region_name, config=LIMITED_CLIENT_CONFIG)
+
+
+def is_throttling_error(error):
+    """Check if a ClientError is AWS pushing back on the request rate."""
+    return error.response.get("Error", {}).get("Code") in THROTTLING_ERROR_CODES
+
+
+def is_transient_error(error):
+    """Check if a ClientError is a server-side failure that is worth retrying."""
+    return error.response.get("ResponseMetadata", {}).get("HTTPStatusCode", 0) >= 500
+
+
+def backoff(attempt):
+    return min(2**attempt * 0.2, 10)
+
+
+def call(client, operation, limiter=None, **kwargs):
+    """
+    Make one API call, taking a token from `limiter` first. Throttling errors are reported
+    to the limiter, which slows down, and the call is retried; server errors and dropped
+    or timed out connections are retried with a backoff. Use a client from make_client()
+    so botocore does not retry first.
+    """
+    method = getattr(client, operation)
+    for attempt in range(MAX_THROTTLE_RETRIES + 1):
+        if limiter is not None:
+            limiter.acquire()
+        try:
+            response = method(**kwargs)
+        except ClientError as error:
+            if attempt == MAX_THROTTLE_RETRIES:
+                raise
+            if is_throttling_error(error):
+                if limiter is not None:
+                    limiter.on_throttle()
+                else:
+                    time.sleep(backoff(attempt))
+            elif is_transient_error(error):
+                time.sleep(backoff(attempt))
+            else:
+                raise
+            continue
+        except CONNECTION_ERRORS:
+            if attempt == MAX_THROTTLE_RETRIES:
+                raise
+            time.sleep(backoff(attempt))
+            continue
+        if limiter is not None:
+            limiter.on_success()
+        return response
+
+
+def paginate(client, operation, limiter=None, **kwargs):
+    """Yield the pages of a NextToken paginated call, each request going through call()."""
+    while True:
+        page = call(client, operation, limiter, **kwargs)
+        yield page
+        if not page.get("NextToken"):
+            return
+        kwargs["NextToken"] = page["NextToken"]
+
+
+def get_services(client, limiter=None):
+    """Retrieve all service codes."""
+    services = []
+    for page in paginate(client, "list_services", limiter):
+        for service_info in page["Services"]:
+            services.append(service_info["ServiceCode"])
+    return services
+
+
+def get_service_quotas(client, service_code, limiter=None):
+    """Retrieve quotas for a given service, or None if the call fails."""
+    try:
+        quotas = []
+        for page in paginate(client, "list_service_quotas", limiter, ServiceCode=service_code):
+            quotas.extend(page["Quotas"])
+        return quotas
+    except (BotoCoreError, ClientError) as error:
+        print(f"Error getting quotas for service {service_code}: {error}")
+        return None
+
+
+def get_cached_service_quotas(client, region, service_code, cache=None, limiter=None):
+    """Return a service's quotas from the snapshot cache when fresh, otherwise fetch and store them."""
+    if cache is not None:
+        quotas = cache.load(region, service_code)
+        if quotas is not None:
+            return quotas
+    quotas = get_service_quotas(client, service_code, limiter)
+    if cache is not None and quotas is not None:
+        cache.store(region, service_code, quotas)
+    return quotas
+
+
+def iter_service_quotas(
+    clients, services, max_workers=DEFAULT_MAX_WORKERS, rate=DEFAULT_RATE, cache=None
+):
+    """
+    Fetch quotas for the requested services in every region on a bounded thread pool.
+
+    `clients` maps region to a service-quotas client and `services` maps region to the
+    service codes to fetch there. Each region gets its own AdaptiveRateLimiter starting
+    at `rate` requests per second. With a QuotaSnapshotCache, fresh snapshots are served from disk
+    and only expired services are fetched. Yields (service_code, {region: quotas}) as soon
+    as a service has been fetched from every region that was asked for it.
+    """
+    limiters = {region: AdaptiveRateLimiter(rate) for region in clients}
+    remaining = {}
+    for service_codes in services.values():
+        for service_code in service_codes:
+            remaining[service_code] = remaining.get(service_code, 0) + 1
+    pending = {service_code: {} for service_code in remaining}
+
+    to_fetch = []
+    for region, service_codes in services.items():
+        for service_code in service_codes:
+            quotas = cache.load(region, service_code) if cache is not None else None
+            if quotas is None:
+                to_fetch.append((region, service_code))
+                continue
+            pending[service_code][region] = quotas
+            remaining[service_code] -= 1
+            if not remaining[service_code]:
+                yield service_code, pending.pop(service_code)
+
+    executor = ThreadPoolExecutor(max_workers=max_workers)
+    try:
+        futures = {
+            executor.submit(
+                get_cached_service_quotas,
+                clients[region],
+                region,
+                service_code,
+                cache,
+                limiters[region],
+            ): (region, service_code)
+            for region, service_code in to_fetch
+        }
+        for future in as_completed(futures):
+            region, service_code = futures[future]
+            pending[service_code][region] = future.result()
+            remaining[service_code] -= 1
+            if not remaining[service_code]:
+                yield service_code, pending.pop(service_code)
+    finally:
+        # The consumer may stop early (closed generator, broken pipe, Ctrl-C): drop the
+        # queued fetches rather than waiting for the rest of the sweep
+        executor.shutdown(wait=False, cancel_futures=True)
+
+
+def index_quotas(quotas):
+    """Index quota records by (ServiceCode, QuotaCode)."""
+    return {(quota["ServiceCode"], quota["QuotaCode"]): quota for quota in quotas}
+
+
+def diff_quotas(quotas1, quotas2):
+    """
+    Hash-join two sets of quota records on (ServiceCode, QuotaCode) and yield a
+    QuotaDiff for every quota whose value differs or that only exists on one side.
+    Either argument may be a list of records or an index from index_quotas().
+    """
+    index1 = quotas1 if isinstance(quotas1, dict) else index_quotas(quotas1)
+    index2 = dict(quotas2) if isinstance(quotas2, dict) else index_quotas(quotas2)
+
+    for (service_code, quota_code), quota1 in index1.items():
+        quota2 = index2.pop((service_code, quota_code), None)
+        if quota2 is None:
+            yield QuotaDiff(
+                ONLY_IN_1, service_code, quota_code, quota1["QuotaName"], quota1["Value"], None
+            )
+        elif quota1["Value"] != quota2["Value"]:
+            yield QuotaDiff(
+                CHANGED, service_code, quota_code, quota1["QuotaName"], quota1["Value"], quota2["Value"]
+            )
+
+    for (service_code, quota_code), quota2 in index2.items():
+        yield QuotaDiff(
+            ONLY_IN_2, service_code, quota_code, quota2["QuotaName"], None, quota2["Value"]
+        )
+
+
+def format_quota_diff(diff, region1, region2):
+    """Render a QuotaDiff as a human-readable line."""
+    if diff.status == CHANGED:
+        return f"Different quota for {diff.service_code} ({diff.quota_name}) in {region1} ({diff.value1}) and {region2} ({diff.value2})"
+    if diff.status == ONLY_IN_1:
+        return f"Quota {diff.quota_name} for {diff.service_code} only exists in {region1} ({diff.value1})"
+    return f"Quota {diff.quota_name} for {diff.service_code} only exists in {region2} ({diff.value2})"
+
+
+def require_pyarrow():
+    """Exit with a hint when the optional pyarrow dependency is missing."""
+    if pa is None:
+        print("Columnar output requires pyarrow, install it with: pip install pyarrow")
+        sys.exit(1)
+
+
+def write_columnar(columns, path, dictionary_columns=()):
+    """
+    Write {column name: values} to Parquet, or to an Arrow IPC file when `path` ends in
+    .arrow or .feather, dictionary encoding the (string) `dictionary_columns`. Raises
+    ImportError when pyarrow is not installed; scripts check with require_pyarrow() first.
+    """
+    if pa is None:
+        raise ImportError("Columnar output requires pyarrow")
+
+    arrays = {}
+    for name, values in columns.items():
+        if name in dictionary_columns:
+            arrays[name] = pa.array(values, type=pa.string()).dictionary_encode()
+        else:
+            arrays[name] = pa.array(values)
+    table = pa.table(arrays)
+
+    if path.endswith((".arrow", ".feather")):
+        with pa.OSFile(path, "wb") as sink, pa.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+    else:
+        pq.write_table(table, path)
@@ -0,0 +1,205 @@
+import pytest
+
+import check_rds_types
+from check_rds_types import OrderableIndex, OrderableOptionsCache
+
+
+def option(version, class_, storage_type=None, multi_az=False, clusters=False, engine_modes=None):
+    return {
+        "EngineVersion": version,
+        "DBInstanceClass": class_,
+        "StorageType": storage_type,
+        "MultiAZCapable": multi_az,
+        "SupportsClusters": clusters,
+        "SupportedEngineModes": engine_modes or ["provisioned"],
+    }
+
+
+CATALOGUE = {
+    "postgres": [
+        option("16.1", "db.m5.large", "gp3", multi_az=True, clusters=True),
+        option("16.1", "db.m5.large", "io1"),
+        option("15.4", "db.r5.large", "gp2", multi_az=True),
+    ],
+    "aurora-postgresql": [
+        option("15.4", "db.r6g.large"),
+        option("15.4", "db.serverless"),
+        option("13.9", "db.r5.large", engine_modes=["provisioned", "serverless"]),
+    ],
+}
+
+
+@pytest.fixture
+def orderable_requests(monkeypatch):
+    """Serve get_orderable_options from CATALOGUE, recording (engine, version, class) per request."""
+    made = []
+
+    def get_orderable_options(region, engine, EngineVersion=None, DBInstanceClass=None):
+        made.append((engine, EngineVersion, DBInstanceClass))
+        return [
+            option_
+            for option_ in CATALOGUE.get(engine, [])
+            if EngineVersion in (None, option_["EngineVersion"])
+            and DBInstanceClass in (None, option_["DBInstanceClass"])
+        ]
+
+    monkeypatch.setattr(check_rds_types, "get_orderable_options", get_orderable_options)
+    return made
+
+
+@pytest.mark.parametrize(
+    "combination, reason",
+    [
+        (("16.1", "db.m5.large", "gp3", True), None),
+        (("16.1", "db.m5.large", "io1", False), None),
+        (("16.1", "db.m5.large", "io1", True), "Multi-AZ not available for this class, engine version and storage type"),
+        (("16.1", "db.m5.large", "gp2", False), "storage type gp2 not available for this class and engine version"),
+        (("16.1", "db.r5.large", "gp2", False), "class not available for this engine version"),
+        (("16.1", "db.x2g.large", "gp3", False), "class not available"),
+        (("17.0", "db.m5.large", "gp3", False), "engine version not available"),
+        (("17.0", "db.x2g.large", "gp3", False), "both class and version not available"),
+    ],
+)
+def test_unavailable_reason_from_a_full_scan(combination, reason):
+    assert OrderableIndex(CATALOGUE["postgres"]).unavailable_reason(*combination) == reason
+
+
+def test_unavailable_reason_of_a_missing_engine():
+    assert OrderableIndex([]).unavailable_reason("8.0.35", "db.m5.large", "gp3", False) == "engine not available"
+
+
+def test_unavailable_reason_from_targeted_pairs():
+    fetched = {("db.m5.large", "16.1"), ("db.r5.large", "16.1")}
+    index = OrderableIndex([option_ for option_ in CATALOGUE["postgres"] if option_["EngineVersion"] == "16.1"], fetched)
+
+    assert index.unavailable_reason("16.1", "db.m5.large", "gp3", True) is None
+    # Without the full catalogue a class missing from a version cannot be told from a missing class or version
+    assert index.unavailable_reason("16.1", "db.r5.large", "gp2", False) == "class and engine version not orderable together"
+    assert index.unavailable_reason("16.1", "db.m5.large", "gp2", False) == (
+        "storage type gp2 not available for this class and engine version"
+    )
+
+
+def test_instances_of_cluster_storage_engines_are_checked_without_storage_and_multi_az():
+    index = OrderableIndex(CATALOGUE["aurora-postgresql"])
+
+    assert index.unavailable_reason("15.4", "db.r6g.large", None, None) is None
+    assert index.unavailable_reason("15.4", "db.r5.large", None, None) == "class not available for this engine version"
+
+
+@pytest.mark.parametrize(
+    "cluster, reason",
+    [
+        (("15.4", "provisioned", check_rds_types.SERVERLESS_V2_CLASS), None),
+        (("13.9", "provisioned", check_rds_types.SERVERLESS_V2_CLASS), "Aurora Serverless v2 not available for this engine version"),
+        (("13.9", "serverless", None), None),
+        (("15.4", "serverless", None), "engine mode serverless not available for this engine version"),
+        (("12.0", "provisioned", None), "engine version not available"),
+    ],
+)
+def test_cluster_unavailable_reason_for_aurora(cluster, reason):
+    assert OrderableIndex(CATALOGUE["aurora-postgresql"]).cluster_unavailable_reason(*cluster) == reason
+
+
+def test_cluster_unavailable_reason_for_multi_az_db_clusters():
+    index = OrderableIndex(CATALOGUE["postgres"])
+
+    assert index.cluster_unavailable_reason("16.1", "provisioned", "db.m5.large") is None
+    assert index.cluster_unavailable_reason("15.4", "provisioned", "db.r5.large") == (
+        "class not available for Multi-AZ DB clusters of this engine version"
+    )
+
+
+def test_cluster_version_is_only_judged_when_every_class_of_it_was_fetched():
+    serverless_only = OrderableIndex([], fetched={(check_rds_types.SERVERLESS_V2_CLASS, "12.0")})
+    whole_version = OrderableIndex([], fetched={(None, "12.0")})
+
+    assert serverless_only.cluster_unavailable_reason("12.0", "provisioned", None) == (
+        "engine mode provisioned not available for this engine version"
+    )
+    assert whole_version.cluster_unavailable_reason("12.0", "provisioned", None) == "engine version not available"
+
+
+def test_cache_refetches_only_when_pairs_are_added(orderable_requests):
+    cache = OrderableOptionsCache(max_workers=2, targeted_max_pairs=5)
+
+    first = cache.get("eu-west-1", "postgres", {("db.m5.large", "16.1")})
+    assert orderable_requests == [("postgres", "16.1", "db.m5.large")]
+
+    # Pairs already fetched are answered from the cached index
+    assert cache.get("eu-west-1", "postgres", {("db.m5.large", "16.1")}) is first
+    assert orderable_requests == [("postgres", "16.1", "db.m5.large")]
+
+    # A new pair refetches, keeping the pairs fetched for the earlier caller
+    orderable_requests.clear()
+    merged = cache.get("eu-west-1", "postgres", {("db.r5.large", "15.4")})
+    assert merged.fetched == {("db.m5.large", "16.1"), ("db.r5.large", "15.4")}
+    assert sorted(orderable_requests) == [("postgres", "15.4", "db.r5.large"), ("postgres", "16.1", "db.m5.large")]
+    assert merged.unavailable_reason("16.1", "db.m5.large", "gp3", True) is None
+
+    # Other regions have their own index
+    orderable_requests.clear()
+    cache.get("us-east-1", "postgres", {("db.m5.large", "16.1")})
+    assert orderable_requests == [("postgres", "16.1", "db.m5.large")]
+
+
+def test_cache_scans_the_whole_engine_above_targeted_max_pairs(orderable_requests):
+    cache = OrderableOptionsCache(max_workers=2, targeted_max_pairs=1)
+    pairs = {("db.m5.large", "16.1"), ("db.r5.large", "15.4")}
+
+    index = cache.get("eu-west-1", "postgres", pairs)
+
+    assert orderable_requests == [("postgres", None, None)]
+    assert index.fetched is None
+    # A full index answers any later pairs without another request
+    assert cache.get("eu-west-1", "postgres", {("db.x2g.large", "17.0")}) is index
+    assert cache.get("eu-west-1", "postgres") is index
+    assert orderable_requests == [("postgres", None, None)]
+
+
+def test_cache_scans_the_whole_engine_when_no_pairs_are_given(orderable_requests):
+    index = OrderableOptionsCache().get("eu-west-1", "postgres")
+
+    assert orderable_requests == [("postgres", None, None)]
+    assert index.fetched is None
+
+
+def test_find_unavailable_combinations_shares_one_fetch_between_instances_and_clusters(orderable_requests):
+    cache = OrderableOptionsCache(max_workers=2, targeted_max_pairs=5)
+    instances = {
+        ("aurora-postgresql", "15.4", "db.r6g.large", None, None): ["writer-1"],
+        ("postgres", "16.1", "db.m5.large", "io1", True): ["reporting"],
+    }
+    clusters = {
+        ("aurora-postgresql", "15.4", "provisioned", check_rds_types.SERVERLESS_V2_CLASS): ["serverless-app"],
+        ("aurora-postgresql", "13.9", "serverless", None): ["legacy-app"],
+        ("aurora-postgresql", "15.4", "serverless", None): ["new-app"],
+    }
+
+    unavailable_instances, unavailable_clusters = check_rds_types.find_unavailable_combinations(
+        instances, "eu-west-1", cache, clusters
+    )
+
+    assert unavailable_instances == {
+        ("postgres", "16.1", "db.m5.large", "io1", True): (
+            ["reporting"],
+            "Multi-AZ not available for this class, engine version and storage type",
+        ),
+    }
+    assert unavailable_clusters == {
+        ("aurora-postgresql", "15.4", "serverless", None): (
+            ["new-app"],
+            "engine mode serverless not available for this engine version",
+        ),
+    }
+    # One targeted request per (class, version) pair of each engine, clusters without a class fetching the whole version
+    assert sorted(orderable_requests, key=str) == sorted(
+        [
+            ("aurora-postgresql", "13.9", None),
+            ("aurora-postgresql", "15.4", None),
+            ("aurora-postgresql", "15.4", "db.r6g.large"),
+            ("aurora-postgresql", "15.4", "db.serverless"),
+            ("postgres", "16.1", "db.m5.large"),
+        ],
+        key=str,
+    )
@@ -0,0 +1,40 @@
+import compare_quotas
+
+
+OFFERED = {
+    "us-east-1": {"ec2", "s3", "braket"},
+    "eu-west-1": {"ec2", "s3", "lambda"},
+    "ap-south-2": {"ec2", "lambda"},
+}
+
+
+def test_services_to_fetch_against_a_baseline():
+    pairs = compare_quotas.region_pairs(list(OFFERED), baseline="us-east-1")
+
+    # Services the baseline lacks are not fetched in the other regions
+    assert compare_quotas.services_to_fetch(OFFERED, pairs) == {
+        "us-east-1": {"ec2", "s3"},
+        "eu-west-1": {"ec2", "s3"},
+        "ap-south-2": {"ec2"},
+    }
+
+
+def test_services_to_fetch_for_every_pair():
+    pairs = compare_quotas.region_pairs(list(OFFERED))
+
+    # Services only one region offers cannot be compared and are not fetched anywhere
+    assert compare_quotas.services_to_fetch(OFFERED, pairs) == {
+        "us-east-1": {"ec2", "s3"},
+        "eu-west-1": {"ec2", "s3", "lambda"},
+        "ap-south-2": {"ec2", "lambda"},
+    }
+
+
+def test_services_to_fetch_keeps_services_shared_with_any_partner():
+    offered = {"r1": {"a", "b"}, "r2": {"a"}, "r3": {"b", "c"}}
+
+    assert compare_quotas.services_to_fetch(offered, compare_quotas.region_pairs(list(offered))) == {
+        "r1": {"a", "b"},
+        "r2": {"a"},
+        "r3": {"b"},
+    }
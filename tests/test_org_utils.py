@@ -0,0 +1,197 @@
+import csv
+import os
+from types import SimpleNamespace
+from unittest import mock
+
+import pytest
+from botocore.exceptions import ClientError
+
+import get_applied_quotas
+import org_utils
+
+CALLER_ACCOUNT = "111111111111"
+
+
+class FakeSTS:
+    def __init__(self, denied=()):
+        self.assumed = []
+        self.denied = set(denied)
+
+    def get_caller_identity(self):
+        return {"Account": CALLER_ACCOUNT}
+
+    def assume_role(self, RoleArn, **kwargs):
+        self.assumed.append(RoleArn)
+        account_id = RoleArn.split(":")[4]
+        if account_id in self.denied:
+            raise ClientError({"Error": {"Code": "AccessDenied", "Message": "denied"}}, "AssumeRole")
+        return {
+            "Credentials": {
+                "AccessKeyId": f"AK{account_id}",
+                "SecretAccessKey": "secret",
+                "SessionToken": "token",
+            }
+        }
+
+
+class FakeOrganizations:
+    def get_paginator(self, operation):
+        assert operation == "list_accounts"
+        pages = [
+            {"Accounts": [{"Id": "111111111111", "Status": "ACTIVE"}, {"Id": "222222222222", "Status": "SUSPENDED"}]},
+            {"Accounts": [{"Id": "333333333333", "Status": "ACTIVE"}]},
+        ]
+        return SimpleNamespace(paginate=lambda: iter(pages))
+
+
+class FakeQuotasClient:
+    """Service Quotas for one account and region: ec2 has L-1 raised above its default in member accounts."""
+
+    def __init__(self, account_id, region, calls):
+        self.account_id = account_id
+        self.region = region
+        self.calls = calls
+
+    def list_services(self, **kwargs):
+        return {"Services": [{"ServiceCode": "ec2"}, {"ServiceCode": "s3"}]}
+
+    def list_service_quotas(self, ServiceCode, **kwargs):
+        self.calls.append((self.account_id, self.region, ServiceCode))
+        value = 5.0 if self.account_id == CALLER_ACCOUNT else 20.0
+        quotas = {
+            "ec2": [{"ServiceCode": "ec2", "QuotaCode": "L-1", "QuotaName": "Running instances", "Value": value}],
+            "s3": [{"ServiceCode": "s3", "QuotaCode": "L-2", "QuotaName": "Buckets", "Value": 100.0}],
+        }
+        return {"Quotas": quotas[ServiceCode]}
+
+    def list_aws_default_service_quotas(self, ServiceCode, **kwargs):
+        defaults = {"ec2": [{"QuotaCode": "L-1", "Value": 5.0}], "s3": [{"QuotaCode": "L-2", "Value": 100.0}]}
+        return {"Quotas": defaults[ServiceCode]}
+
+
+class FakeBaseSession:
+    def __init__(self, sts, calls=None):
+        self.sts = sts
+        self.calls = calls if calls is not None else []
+
+    def client(self, name, region_name=None, **kwargs):
+        if name == "service-quotas":
+            return FakeQuotasClient(CALLER_ACCOUNT, region_name, self.calls)
+        return {"sts": self.sts, "organizations": FakeOrganizations()}[name]
+
+
+class FakeMemberSession:
+    def __init__(self, calls, **credentials):
+        self.calls = calls
+        self.credentials = credentials
+
+    def client(self, name, region_name=None, **kwargs):
+        assert name == "service-quotas"
+        return FakeQuotasClient(self.credentials["aws_access_key_id"][2:], region_name, self.calls)
+
+
+@pytest.fixture
+def sts():
+    return FakeSTS(denied={"444444444444"})
+
+
+@pytest.fixture
+def account_sessions(sts):
+    return org_utils.AccountSessions("AuditRole", FakeBaseSession(sts))
+
+
+@pytest.fixture(autouse=True)
+def fake_boto3_session():
+    # Sessions handed out for member accounts only record the credentials they were given
+    with mock.patch.object(org_utils.boto3, "Session", side_effect=lambda **kwargs: SimpleNamespace(**kwargs)):
+        yield
+
+
+def test_list_member_accounts_skips_inactive_accounts(sts):
+    assert org_utils.list_member_accounts(FakeBaseSession(sts)) == ["111111111111", "333333333333"]
+
+
+def test_account_sessions_assume_each_account_once(account_sessions, sts):
+    first = account_sessions.session("333333333333")
+    second = account_sessions.session("333333333333")
+
+    assert sts.assumed == ["arn:aws:iam::333333333333:role/AuditRole"]
+    assert first is not second
+    assert first.aws_access_key_id == second.aws_access_key_id == "AK333333333333"
+
+
+def test_account_sessions_use_the_base_session_for_the_caller_account(account_sessions, sts):
+    assert account_sessions.session(CALLER_ACCOUNT) is account_sessions.base_session
+    assert sts.assumed == []
+
+
+def test_for_each_account_region_reports_failures_and_continues(account_sessions, sts, capsys):
+    def func(session, account_id, region):
+        if region == "eu-bad-1":
+            raise ValueError("unexpected response")
+        return (session.aws_access_key_id, region)
+
+    results = {
+        (account_id, region): result
+        for account_id, region, result in org_utils.for_each_account_region(
+            func, ["333333333333", "444444444444"], ["eu-west-1", "eu-bad-1"], account_sessions, max_workers=4
+        )
+    }
+
+    assert results == {
+        ("333333333333", "eu-west-1"): ("AK333333333333", "eu-west-1"),
+        ("333333333333", "eu-bad-1"): None,
+        ("444444444444", "eu-west-1"): None,
+        ("444444444444", "eu-bad-1"): None,
+    }
+    # A successful assume is reused for every region, a denied one is retried per region
+    assert sts.assumed.count("arn:aws:iam::333333333333:role/AuditRole") == 1
+    assert sts.assumed.count("arn:aws:iam::444444444444:role/AuditRole") == 2
+    output = capsys.readouterr().out
+    assert "Error processing account 333333333333 in eu-bad-1: unexpected response" in output
+    assert "Error processing account 444444444444 in eu-west-1" in output
+
+
+def read_rows(path):
+    with open(path, newline="") as file:
+        return list(csv.DictReader(file))
+
+
+def test_check_fleet_quotas_writes_a_partition_per_account_and_region(sts, tmp_path):
+    calls = []
+    output_dir = str(tmp_path / "out")
+    cache_dir = str(tmp_path / "cache")
+    # A sweep interrupted after ec2 in one partition, to be resumed
+    interrupted = os.path.join(output_dir, "333333333333", "eu-west-1")
+    os.makedirs(interrupted)
+    with open(os.path.join(interrupted, "service_quotas.csv"), "w", newline="") as file:
+        file.write("Service,Quota Name,Applied Quota,Default Quota\nec2,Running instances,20.0,5.0\n")
+    with open(os.path.join(interrupted, "service_quotas.csv.checkpoint"), "w") as file:
+        file.write("ec2\n")
+
+    def new_session(**kwargs):
+        return FakeMemberSession(calls, **kwargs) if kwargs else FakeBaseSession(sts, calls)
+
+    with mock.patch.object(org_utils.boto3, "Session", side_effect=new_session):
+        get_applied_quotas.check_fleet_quotas(
+            ["eu-west-1", "us-east-1"], role_name="AuditRole", output_dir=output_dir, cache_dir=cache_dir, resume=True
+        )
+
+    for account_id in ("111111111111", "333333333333"):
+        for region in ("eu-west-1", "us-east-1"):
+            partition = os.path.join(output_dir, account_id, region)
+            rows = read_rows(os.path.join(partition, "service_quotas.csv"))
+            # Only the member account has raised ec2 above its default
+            expected = [] if account_id == CALLER_ACCOUNT else [
+                {"Service": "ec2", "Quota Name": "Running instances", "Applied Quota": "20.0", "Default Quota": "5.0"}
+            ]
+            assert rows == expected
+            assert not os.path.exists(os.path.join(partition, "service_quotas.csv.checkpoint"))
+            # Snapshots are kept per account, keyed by the account of the partition
+            assert os.path.exists(os.path.join(cache_dir, account_id, region, "s3.json.gz"))
+
+    # The resumed partition skips the service it had already written
+    assert ("333333333333", "eu-west-1", "ec2") not in calls
+    assert ("333333333333", "us-east-1", "ec2") in calls
+    # The caller's account is swept with its own session rather than by assuming the role
+    assert sts.assumed == ["arn:aws:iam::333333333333:role/AuditRole"]
@@ -0,0 +1,110 @@
+import time
+from types import SimpleNamespace
+
+import pytest
+
+import quota_utils
+
+
+class FakeSession:
+    def __init__(self, account_id):
+        self.account_id = account_id
+        self.identity_calls = 0
+
+    def client(self, name, **kwargs):
+        assert name == "sts"
+
+        def get_caller_identity():
+            self.identity_calls += 1
+            return {"Account": self.account_id}
+
+        return SimpleNamespace(get_caller_identity=get_caller_identity)
+
+
+QUOTAS = [{"ServiceCode": "ec2", "QuotaCode": "L-1", "QuotaName": "Running instances", "Value": 64.0}]
+
+
+def test_snapshot_cache_keeps_accounts_apart(tmp_path):
+    source_session = FakeSession("111111111111")
+    source = quota_utils.QuotaSnapshotCache(str(tmp_path), session=source_session)
+    source.store("eu-west-1", "ec2", QUOTAS)
+    target = quota_utils.QuotaSnapshotCache(str(tmp_path), session=FakeSession("222222222222"))
+
+    assert source.load("eu-west-1", "ec2") == QUOTAS
+    assert target.load("eu-west-1", "ec2") is None
+    assert (tmp_path / "111111111111" / "eu-west-1" / "ec2.json.gz").exists()
+    assert source_session.identity_calls == 1
+
+
+def test_snapshot_cache_takes_a_known_account_without_sts(tmp_path):
+    cache = quota_utils.QuotaSnapshotCache(str(tmp_path), account_id="333333333333")
+    cache.store("eu-west-1", "ec2", QUOTAS)
+
+    assert quota_utils.QuotaSnapshotCache(str(tmp_path), account_id="333333333333").load("eu-west-1", "ec2") == QUOTAS
+
+
+def test_snapshot_cache_expires_old_snapshots(tmp_path):
+    cache = quota_utils.QuotaSnapshotCache(str(tmp_path), ttl=-1, account_id="333333333333")
+    cache.store("eu-west-1", "ec2", QUOTAS)
+
+    assert cache.load("eu-west-1", "ec2") is None
+
+
+class FlakyClient:
+    def __init__(self, *errors):
+        self.errors = list(errors)
+        self.calls = 0
+
+    def list_services(self, **kwargs):
+        self.calls += 1
+        if self.errors:
+            raise self.errors.pop(0)
+        return {"Services": []}
+
+
+def test_call_retries_connection_errors(monkeypatch):
+    monkeypatch.setattr(quota_utils.time, "sleep", lambda seconds: None)
+    client = FlakyClient(
+        quota_utils.EndpointConnectionError(endpoint_url="https://servicequotas"),
+        quota_utils.ReadTimeoutError(endpoint_url="https://servicequotas"),
+    )
+
+    assert quota_utils.call(client, "list_services") == {"Services": []}
+    assert client.calls == 3
+
+
+def test_call_gives_up_on_a_persistent_connection_error(monkeypatch):
+    monkeypatch.setattr(quota_utils.time, "sleep", lambda seconds: None)
+    error = quota_utils.ConnectTimeoutError(endpoint_url="https://servicequotas")
+    client = FlakyClient(*[error] * (quota_utils.MAX_THROTTLE_RETRIES + 1))
+
+    with pytest.raises(quota_utils.ConnectTimeoutError):
+        quota_utils.call(client, "list_services")
+    assert client.calls == quota_utils.MAX_THROTTLE_RETRIES + 1
+
+
+class SlowQuotasClient:
+    def __init__(self, delay):
+        self.delay = delay
+        self.calls = 0
+
+    def list_service_quotas(self, ServiceCode, **kwargs):
+        self.calls += 1
+        time.sleep(self.delay)
+        return {"Quotas": [{"ServiceCode": ServiceCode, "QuotaCode": "L-1", "QuotaName": "q", "Value": 1.0}]}
+
+
+def test_iter_service_quotas_does_not_wait_for_the_sweep_when_closed_early():
+    client = SlowQuotasClient(delay=0.05)
+    services = [f"service-{i}" for i in range(40)]
+    fetched = quota_utils.iter_service_quotas({"r1": client}, {"r1": services}, max_workers=2, rate=1000)
+
+    started = time.monotonic()
+    service_code, quotas = next(fetched)
+    fetched.close()
+
+    assert service_code in services and quotas["r1"][0]["ServiceCode"] == service_code
+    # 40 services on 2 workers take a second; only the fetches already running finish
+    assert time.monotonic() - started < 0.5
+    time.sleep(0.1)
+    assert client.calls < len(services)
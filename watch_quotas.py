@@ -0,0 +1,147 @@
+"""
+Watches the Service Quotas of a region for drift, printing only the quotas that are new,
+removed or changed since the previous run
+"""
+
+import argparse
+import hashlib
+import json
+import os
+
+import quota_async
+from quota_utils import (
+    CHANGED,
+    DEFAULT_MAX_WORKERS,
+    DEFAULT_RATE,
+    ONLY_IN_1,
+    QuotaSnapshotCache,
+    diff_quotas,
+    get_services,
+    iter_service_quotas,
+    make_client,
+)
+
+DEFAULT_STATE_DIR = ".quota_watch"
+
+
+def fingerprint_quotas(quotas):
+    """Return a cheap fingerprint of a service's quotas: the quota count plus a hash of (QuotaCode, Value)."""
+    digest = hashlib.sha256()
+    for quota_code, value in sorted((quota["QuotaCode"], quota["Value"]) for quota in quotas):
+        digest.update(f"{quota_code}={value}\n".encode("utf-8"))
+    return f"{len(quotas)}:{digest.hexdigest()[:16]}"
+
+
+def load_fingerprints(path):
+    """Return the {service_code: fingerprint} recorded by the previous run."""
+    if not os.path.exists(path):
+        return None
+    with open(path, "r", encoding="utf-8") as file:
+        return json.load(file)
+
+
+def save_fingerprints(path, fingerprints):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path + ".tmp", "w", encoding="utf-8") as file:
+        json.dump(fingerprints, file, indent=1, sort_keys=True)
+    os.replace(path + ".tmp", path)
+
+
+def format_drift(diff, region):
+    if diff.status == CHANGED:
+        return f"Changed quota for {diff.service_code} ({diff.quota_name}) in {region}: {diff.value1} -> {diff.value2}"
+    if diff.status == ONLY_IN_1:
+        return f"Removed quota {diff.quota_name} for {diff.service_code} in {region} (was {diff.value1})"
+    return f"New quota {diff.quota_name} for {diff.service_code} in {region} ({diff.value2})"
+
+
+def watch_quotas(
+    region, state_dir=DEFAULT_STATE_DIR, max_workers=DEFAULT_MAX_WORKERS, rate=DEFAULT_RATE, backend="threads"
+):
+    """
+    Compare the region's quotas with the snapshot kept from the previous run and print the drift.
+    Services whose fingerprint is unchanged are skipped without reading their previous
+    snapshot; only changed services are diffed and have their snapshot rewritten.
+    The asyncio backend keeps up to `max_workers` paginations in flight on one thread.
+    """
+    client = make_client("service-quotas", region)
+    # The previous run's snapshots never expire, they are replaced when a service drifts
+    snapshots = QuotaSnapshotCache(state_dir, ttl=float("inf"))
+    fingerprints_file = os.path.join(state_dir, snapshots.account_id, region, "fingerprints.json")
+    previous = load_fingerprints(fingerprints_file)
+
+    services = get_services(client)
+    fingerprints = {}
+    drifted = 0
+    if backend == "asyncio":
+        fetched = quota_async.iter_service_quotas({region: services}, max_workers, rate)
+    else:
+        fetched = iter_service_quotas({region: client}, {region: services}, max_workers, rate)
+    for service_code, quotas in fetched:
+        current_quotas = quotas[region]
+        if current_quotas is None:
+            # Keep the old fingerprint so the service is compared again next run
+            if previous and service_code in previous:
+                fingerprints[service_code] = previous[service_code]
+            continue
+
+        fingerprints[service_code] = fingerprint_quotas(current_quotas)
+        if previous is not None and previous.get(service_code) == fingerprints[service_code]:
+            continue
+
+        if previous is not None:
+            previous_quotas = snapshots.load(region, service_code) or []
+            for diff in diff_quotas(previous_quotas, current_quotas):
+                print(format_drift(diff, region))
+            drifted += 1
+        snapshots.store(region, service_code, current_quotas)
+
+    if previous is None:
+        print(f"Recorded a baseline of {len(fingerprints)} services in {region}, drift is reported from the next run")
+    else:
+        for service_code in sorted(set(previous) - set(fingerprints)):
+            for diff in diff_quotas(snapshots.load(region, service_code) or [], []):
+                print(format_drift(diff, region))
+            drifted += 1
+        print(f"{drifted} services in {region} drifted since the previous run ({len(fingerprints)} checked)")
+
+    save_fingerprints(fingerprints_file, fingerprints)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Report the Service Quotas that changed since the previous run"
+    )
+    parser.add_argument("region", help="Region to watch")
+    parser.add_argument(
+        "--state-dir",
+        default=DEFAULT_STATE_DIR,
+        help=f"Directory holding the previous run's snapshot (default {DEFAULT_STATE_DIR})",
+    )
+    parser.add_argument(
+        "--max-workers",
+        type=int,
+        help=f"Number of services fetched concurrently (default {DEFAULT_MAX_WORKERS} threads, "
+        f"or {quota_async.DEFAULT_CONCURRENCY} with --backend asyncio)",
+    )
+    parser.add_argument(
+        "--backend",
+        choices=["threads", "asyncio"],
+        default="threads",
+        help="Fetch on a thread pool, or on one asyncio event loop (requires aiobotocore)",
+    )
+    parser.add_argument(
+        "--rate",
+        type=float,
+        default=DEFAULT_RATE,
+        help=f"Starting Service Quotas requests per second (default {DEFAULT_RATE})",
+    )
+    args = parser.parse_args()
+
+    if args.backend == "asyncio":
+        quota_async.require_aiobotocore()
+    max_workers = args.max_workers or (
+        quota_async.DEFAULT_CONCURRENCY if args.backend == "asyncio" else DEFAULT_MAX_WORKERS
+    )
+
+    watch_quotas(args.region, args.state_dir, max_workers, args.rate, args.backend)